@@ -198,6 +198,7 @@ class InputBox(Widget):
         value: string
             value of textbox
         """
+        self.entry.delete(0,tk.END)
         self.entry.insert(0,value)
 
     def getvalue(self):
@@ -0,0 +1,57 @@
+#Activity adaptive shot rate. Frame to frame change (from lapse.change, on small
+#grayscale copies) is smoothed, and the shot interval halves while the screen is busy
+#and doubles while it is idle, between the configured bounds. The gap between the busy
+#and idle levels, plus a few shots of patience before every change, keep the rate from
+#flapping back and forth.
+
+class AdaptiveRate():
+	
+	def __init__(self,mininterval,maxinterval,busy=0.02,idle=0.002,patience=3,smoothing=0.3):
+		
+		self.mininterval = mininterval
+		self.maxinterval = maxinterval
+		
+		#Smoothed fraction of changed pixels above which the screen counts as busy,
+		#and below which it counts as idle
+		self.busy = busy
+		self.idle = idle
+		
+		#Shots in a row the screen has to be busy or idle before the rate changes
+		self.patience = patience
+		self.smoothing = smoothing
+		
+		self.activity = None
+		self.streak = 0
+		
+	def clamp(self,interval):
+		return min(self.maxinterval,max(self.mininterval,interval))
+		
+	#Feed the change score of the latest shot, returns the new interval or None to keep it
+	def update(self,score,interval):
+		
+		if self.activity == None:
+			self.activity = score
+		else:
+			self.activity += self.smoothing * (score - self.activity)
+			
+		if self.activity > self.busy:
+			self.streak = max(1,self.streak + 1)
+		elif self.activity < self.idle:
+			self.streak = min(-1,self.streak - 1)
+		else:
+			self.streak = 0
+			
+		if abs(self.streak) < self.patience:
+			return None
+		
+		#Only ever towards the bound, an interval outside the bounds is pulled back in
+		if self.streak > 0:
+			target = min(interval,max(self.mininterval,interval / 2))
+		else:
+			target = max(interval,min(self.maxinterval,interval * 2))
+			
+		self.streak = 0
+		
+		if target == interval:
+			return None
+		return target
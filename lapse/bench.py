@@ -0,0 +1,179 @@
+#Capture/encode/write/export benchmark.
+#
+#	python -m lapse.bench --resolutions 1920x1080,3840x2160 --codecs png:1,jpeg:90 --workers 1,4
+#
+#Runs every combination on a capture backend (synthetic by default, so no display is
+#needed) and prints per stage latency percentiles, frames/s and bytes per frame as JSON.
+
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import os
+
+from lapse import capture
+from lapse import codec
+from lapse import export
+from lapse.settings import Settings
+from lapse.metrics import percentiles
+from lapse.writer import WriterPool
+
+def timed(function,*args):
+	
+	start = time.perf_counter()
+	result = function(*args)
+	return result,time.perf_counter() - start
+
+def benchcapture(backend,size,frames):
+	
+	bbox = (0,0,size[0],size[1])
+	images = []
+	times = []
+	
+	for i in range(frames):
+		image,seconds = timed(backend.grab,bbox)
+		images.append(image)
+		times.append(seconds)
+		
+	return images,{"latency_ms":percentiles(times),"fps":frames / sum(times)}
+
+#Encode and write through the same writer pool the recorder uses
+def benchwrite(images,framecodec,workers,folder):
+	
+	results = []
+	
+	pool = WriterPool(framecodec.spec,benchsettings(folder,framecodec).framepath,lambda index,info,result: results.append(result),workers,workers * 2)
+	
+	#Start up the encoder processes first, that's not what is being measured
+	pool.warmup()
+	
+	start = time.perf_counter()
+	for image in images:
+		pool.put(image,{})
+	pool.close()
+	total = time.perf_counter() - start
+	
+	sizes = [result[2] for result in results]
+	
+	return {
+		"encode":{"latency_ms":percentiles([result[0] for result in results])},
+		"write":{"latency_ms":percentiles([result[1] for result in results])},
+		"fps":len(images) / total,
+		"bytes_per_frame":sum(sizes) / len(sizes),
+	}
+
+#Settings for exporting the frames benchwrite left in folder
+def benchsettings(folder,framecodec):
+	
+	settings = Settings()
+	settings.folder = folder
+	settings.codec = framecodec.spec
+	settings.fps = 30.0
+	return settings
+
+#Export in a single pass, then split across each of exportworkers encoders
+def benchexport(folder,framecodec,frames,exportworkers):
+	
+	if shutil.which("ffmpeg") == None:
+		return {"skipped":"ffmpeg not found"}
+	
+	settings = benchsettings(folder,framecodec)
+	output = os.path.join(folder,"video.mp4")
+	result = {}
+	single = None
+	
+	for workers in exportworkers:
+		settings.export_workers = workers
+		try:
+			ignored,seconds = timed(export.export,settings,output)
+		except RuntimeError as e:
+			result[str(workers)] = {"failed":str(e)}
+			continue
+		
+		if workers == 1:
+			single = seconds
+		
+		result[str(workers)] = {"seconds":seconds,"fps":frames / seconds,"bytes":os.path.getsize(output)}
+		if single != None:
+			result[str(workers)]["speedup"] = single / seconds
+			
+	return result
+
+def run(resolutions,codecspecs,workercounts,frames,backendname,exportworkers):
+	
+	results = []
+	backend = capture.create(backendname)
+	
+	try:
+		for size in resolutions:
+			
+			images,capturestats = benchcapture(backend,size,frames)
+			
+			for spec in codecspecs:
+				
+				framecodec = codec.parse(spec)
+				
+				for workers in workercounts:
+					
+					folder = tempfile.mkdtemp(prefix="screenlapse-bench-")
+					try:
+						stats = benchwrite(images,framecodec,workers,folder)
+						
+						result = {
+							"resolution":"{}x{}".format(*size),
+							"codec":spec,
+							"workers":workers,
+							"frames":frames,
+							"capture":capturestats,
+						}
+						result.update(stats)
+						
+						if len(exportworkers) > 0:
+							result["export"] = benchexport(folder,framecodec,frames,exportworkers)
+							
+						results.append(result)
+					finally:
+						shutil.rmtree(folder,ignore_errors=True)
+	finally:
+		backend.close()
+		
+	return {"backend":backendname,"results":results}
+
+def parsesize(text):
+	
+	width,height = text.lower().split("x")
+	return (int(width),int(height))
+
+def main():
+	
+	parser = argparse.ArgumentParser(description="Benchmark the screenlapse capture pipeline")
+	parser.add_argument("--resolutions",default="1920x1080,3840x1080,3840x2160")
+	parser.add_argument("--codecs",default="png,png:1,webp-lossless,raw,jpeg:90")
+	parser.add_argument("--workers",default="1,2,4")
+	parser.add_argument("--frames",type=int,default=20)
+	parser.add_argument("--backend",default="synthetic",choices=list(capture.backends))
+	parser.add_argument("--export-workers",default="1,4",help="export encoder counts to compare, 1 first for the speedup")
+	parser.add_argument("--no-export",action="store_true",help="skip the ffmpeg export stage")
+	parser.add_argument("--output",help="write the JSON report here instead of stdout")
+	args = parser.parse_args()
+	
+	report = run(
+		[parsesize(size) for size in args.resolutions.split(",")],
+		args.codecs.split(","),
+		[int(workers) for workers in args.workers.split(",")],
+		args.frames,
+		args.backend,
+		[] if args.no_export else [int(workers) for workers in args.export_workers.split(",")]
+	)
+	
+	text = json.dumps(report,indent=2)
+	
+	if args.output:
+		with open(args.output,"w") as f:
+			f.write(text + "\n")
+	else:
+		print(text)
+		
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,185 @@
+#Capture backends. Every backend grabs a bbox (x0,y0,x1,y1) of the screen into an RGB
+#PIL image. probe() times the available ones on the real bbox and picks the fastest.
+
+import time
+
+from PIL import Image, ImageDraw
+
+try:
+	import pyscreenshot as ImageGrab
+except ImportError:
+	ImageGrab = None
+	
+try:
+	import mss
+except ImportError:
+	mss = None
+
+class Backend():
+	
+	name = None
+	
+	@classmethod
+	def available(cls):
+		return True
+	
+	def grab(self,bbox):
+		raise NotImplementedError
+	
+	def close(self):
+		pass
+	
+#Whatever pyscreenshot picks. Depending on the platform this can spawn a process or
+#go through a temp file on every grab
+class PyscreenshotBackend(Backend):
+	
+	name = "pyscreenshot"
+	
+	@classmethod
+	def available(cls):
+		return ImageGrab != None
+	
+	def grab(self,bbox):
+		
+		im = ImageGrab.grab(bbox=bbox)
+		if im.mode != "RGB":
+			im = im.convert("RGB")
+		return im
+	
+#Direct grab through mss, which uses XShm shared memory on X11 and BitBlt on windows
+class MSSBackend(Backend):
+	
+	name = "mss"
+	
+	def __init__(self):
+		self.sct = None
+		
+	@classmethod
+	def available(cls):
+		return mss != None
+	
+	def grab(self,bbox):
+		
+		#mss handles belong to the thread that created them, so create it on first grab
+		if self.sct == None:
+			self.sct = mss.mss()
+			
+		x0,y0,x1,y1 = bbox
+		shot = self.sct.grab({"left":x0,"top":y0,"width":x1 - x0,"height":y1 - y0})
+		
+		#One conversion straight out of the BGRA buffer mss hands back
+		return Image.frombuffer("RGB",shot.size,shot.bgra,"raw","BGRX")
+	
+	def close(self):
+		
+		if self.sct != None:
+			self.sct.close()
+			self.sct = None
+			
+#Synthetic frames: a static pattern with a box sweeping over it, so every frame differs.
+#Needs no display at all, for testing and benchmarking
+class SyntheticBackend(Backend):
+	
+	name = "synthetic"
+	
+	def __init__(self):
+		self.background = None
+		self.frame = 0
+		
+	def grab(self,bbox):
+		
+		x0,y0,x1,y1 = bbox
+		size = (x1 - x0,y1 - y0)
+		
+		if self.background == None or self.background.size != size:
+			self.background = Image.linear_gradient("L").resize(size).convert("RGB")
+			
+		im = self.background.copy()
+		
+		step = max(1,size[0] // 50)
+		x = (self.frame * step) % size[0]
+		ImageDraw.Draw(im).rectangle((x,0,x + step,size[1] // 2),fill=(255,64,0))
+		
+		self.frame += 1
+		return im
+	
+#Shrink a grab to the output size, right after grabbing. Whole factors use reduce(),
+#which just averages blocks of pixels; anything else uses the box filter, which is
+#nearly as cheap and still looks fine for screen content
+def resize(image,size):
+	
+	if image.size == size:
+		return image
+	
+	width,height = image.size
+	if width % size[0] == 0 and height % size[1] == 0 and width // size[0] == height // size[1]:
+		return image.reduce(width // size[0])
+	
+	return image.resize(size,Image.BOX)
+
+backends = {
+	PyscreenshotBackend.name:PyscreenshotBackend,
+	MSSBackend.name:MSSBackend,
+	SyntheticBackend.name:SyntheticBackend,
+}
+
+#Names of the backends that can be used here. synthetic is left out of auto selection
+def availablebackends():
+	return [name for name,backend in backends.items() if backend.available()]
+
+def create(name):
+	
+	if name not in backends:
+		raise ValueError("Unknown capture backend " + name)
+	
+	backend = backends[name]
+	if not backend.available():
+		raise RuntimeError("Capture backend " + name + " is not installed")
+	
+	return backend()
+
+#Time each real backend on bbox and return (fastest backend, {name:median seconds})
+def probe(bbox,shots=3):
+	
+	timings = {}
+	best = None
+	
+	for name in availablebackends():
+		
+		if name == SyntheticBackend.name:
+			continue
+		
+		backend = backends[name]()
+		
+		try:
+			times = []
+			for i in range(shots):
+				start = time.perf_counter()
+				backend.grab(bbox)
+				times.append(time.perf_counter() - start)
+		except Exception:
+			backend.close()
+			continue
+		
+		times.sort()
+		timings[name] = times[len(times) // 2]
+		
+		if best == None or timings[name] < timings[best.name]:
+			if best != None:
+				best.close()
+			best = backend
+		else:
+			backend.close()
+			
+	if best == None:
+		raise RuntimeError("No working capture backend, install mss or pyscreenshot")
+	
+	return best,timings
+
+#Open the configured backend, probing for the fastest one on "auto"
+def select(name,bbox):
+	
+	if name == "auto":
+		return probe(bbox)
+	
+	return create(name),{}
@@ -0,0 +1,65 @@
+#Change detection between shots. Frames are compared on a small grayscale copy, as
+#numpy arrays, so a 4k frame costs about as much as a thumbnail to check.
+
+import numpy as np
+
+class ChangeDetector():
+	
+	def __init__(self,threshold,tolerance=16,scale=8,mask=None):
+		
+		#Fraction of pixels that has to change for a frame to be kept
+		self.threshold = threshold
+		#Difference in brightness (0-255) for a single pixel to count as changed
+		self.tolerance = tolerance
+		#Downsampling factor
+		self.scale = scale
+		#Boxes (x0,y0,x1,y1) in frame coordinates to ignore, like a taskbar clock
+		self.mask = mask or []
+		
+		self.last = None
+		self.weights = None
+		
+	def thumbnail(self,image):
+		
+		small = image.convert("L").reduce(self.scale)
+		return np.asarray(small,dtype=np.int16)
+	
+	#Boolean array of pixels that are compared, built once per frame size
+	def buildweights(self,shape):
+		
+		weights = np.ones(shape,dtype=bool)
+		for x0,y0,x1,y1 in self.mask:
+			weights[y0 // self.scale:-(-y1 // self.scale),x0 // self.scale:-(-x1 // self.scale)] = False
+		return weights
+	
+	#Fraction of compared pixels that changed between a and b
+	def score(self,a,b):
+		
+		changed = np.abs(a - b) > self.tolerance
+		
+		if len(self.mask) == 0:
+			return float(np.count_nonzero(changed)) / changed.size
+		
+		total = np.count_nonzero(self.weights)
+		if total == 0:
+			return 0.0
+		return float(np.count_nonzero(changed & self.weights) / total)
+	
+	#Returns (keep,score). Kept frames become the reference for the next check.
+	#A thumbnail made earlier for the same image can be passed in to skip making it again
+	def check(self,image,current=None):
+		
+		if current is None:
+			current = self.thumbnail(image)
+		
+		if self.last is None or self.last.shape != current.shape:
+			self.last = current
+			self.weights = self.buildweights(current.shape)
+			return True,1.0
+		
+		score = self.score(current,self.last)
+		if score < self.threshold:
+			return False,score
+		
+		self.last = current
+		return True,score
@@ -0,0 +1,62 @@
+#Frame storage codecs. A codec is picked by a spec string, "name" or "name:level":
+#
+#	png:N          png with compress level N (0-9, default 6)
+#	qoi            lossless and quick to decode, but pillow's encoder is slow on big frames
+#	webp-lossless  lossless webp at the fastest method
+#	raw            uncompressed ppm
+#	jpeg:Q         lossy jpeg at quality Q (default 90)
+#	webp:Q         lossy webp at quality Q (default 90)
+
+import io
+
+from PIL import Image
+
+class Codec():
+	
+	def __init__(self,spec,format,extension,pipe,lossless,params=None):
+		
+		self.spec = spec
+		self.format = format
+		self.extension = extension
+		#ffmpeg demuxer for a stream of these images on a pipe
+		self.pipe = pipe
+		self.lossless = lossless
+		self.params = params or {}
+		
+	def available(self):
+		
+		Image.init()
+		return self.format in Image.SAVE
+	
+	def encode(self,image):
+		
+		buffer = io.BytesIO()
+		image.save(buffer,self.format,**self.params)
+		return buffer.getvalue()
+	
+names = ["png","qoi","webp-lossless","raw","jpeg","webp"]
+
+def parse(spec):
+	
+	name,ignored,level = spec.partition(":")
+	
+	if name not in names:
+		raise ValueError("Unknown frame codec " + spec + ", expected one of " + ", ".join(names))
+	
+	if name == "png":
+		codec = Codec(spec,"PNG","png","png_pipe",True,{"compress_level":int(level or 6)})
+	elif name == "qoi":
+		codec = Codec(spec,"QOI","qoi","qoi_pipe",True)
+	elif name == "webp-lossless":
+		codec = Codec(spec,"WEBP","webp","webp_pipe",True,{"lossless":True,"quality":0,"method":0})
+	elif name == "raw":
+		codec = Codec(spec,"PPM","ppm","ppm_pipe",True)
+	elif name == "jpeg":
+		codec = Codec(spec,"JPEG","jpg","jpeg_pipe",False,{"quality":int(level or 90)})
+	elif name == "webp":
+		codec = Codec(spec,"WEBP","webp","webp_pipe",False,{"quality":int(level or 90),"method":0})
+		
+	if not codec.available():
+		raise RuntimeError("Pillow can't write " + codec.format + " here, pick another frame codec")
+	
+	return codec
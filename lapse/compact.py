@@ -0,0 +1,182 @@
+#Compaction. Loose frame files take far more disk than the same frames in a lossless video
+#codec, and tens of thousands of them slow down everything that lists the folder. While
+#recording continues, every closed run of frames is encoded into an FFV1 chunk in chunks/
+#at low priority, checked frame by frame against the files, and only then are the files
+#deleted. The frame index then points at the chunk, and exports read those frames from it
+#through a manifest (see lapse.manifest), so nothing else has to know. The concat demuxer
+#can't mix chunks with image files, so the last, partial run is compacted too when the
+#recording stops, and exports compact whatever an interrupted recording left as files.
+
+import itertools
+import threading
+import logging
+import queue
+import glob
+import re
+import os
+
+from lapse import ffmpeg
+from lapse.index import FrameIndex
+
+log = logging.getLogger("screenlapse")
+
+#Every frame of a chunk is a keyframe, so any one of them can be cut out exactly.
+#Frame n of a chunk is at n ms, the same clock manifests read images on
+chunkrate = 1000
+chunkoptions = ["-c:v","ffv1","-level","3","-g","1","-slicecrc","1"]
+
+class Compactor(threading.Thread):
+	
+	def __init__(self,settings,index):
+		
+		threading.Thread.__init__(self,daemon=True)
+		
+		self.settings = settings
+		self.index = index
+		self.folder = os.path.join(settings.folder,"chunks")
+		
+		self.pending = queue.Queue()
+		self.closed = 0
+		#Bytes the chunks saved over the files they replaced
+		self.saved = 0
+		self.error = None
+		
+	def start(self):
+		
+		os.makedirs(self.folder,exist_ok=True)
+		self.recover()
+		threading.Thread.start(self)
+		
+	#Finish what an interrupted recording was compacting. Chunks that weren't checked yet
+	#are thrown away, checked ones get their frames moved over again
+	def recover(self):
+		
+		for path in glob.glob(os.path.join(self.folder,"*.tmp")):
+			os.remove(path)
+			
+		for start,stop,path in chunks(self.settings.folder):
+			self.moved(start,stop,path)
+			self.closed = max(self.closed,stop)
+			
+	#Called by the capture worker with the number of frames the journal has synced, so
+	#a crash can't take back any frame that is compacted
+	def frameadded(self,count):
+		
+		while count - self.closed >= self.settings.compact_frames:
+			self.pending.put((self.closed,self.closed + self.settings.compact_frames))
+			self.closed += self.settings.compact_frames
+			
+	#Compact the frames after the last chunk, count in all, and wait for every chunk
+	def close(self,count):
+		
+		if count > self.closed:
+			self.pending.put((self.closed,count))
+			self.closed = count
+			
+		self.pending.put(None)
+		self.join()
+		
+	def run(self):
+		
+		while True:
+			run = self.pending.get()
+			if run == None:
+				return
+				
+			#The frames are still fine as files, after a failure they just stay that way
+			if self.error != None:
+				continue
+				
+			try:
+				self.compact(*run)
+			except Exception as e:
+				log.warning("Compacting frames %d to %d failed, keeping them as files: %s", run[0], run[1] - 1, e)
+				self.error = e
+				
+	def compact(self,start,stop):
+		
+		path = chunkpath(self.settings.folder,start,stop)
+		temp = path + ".tmp"
+		sums = [path + ".source.tmp",path + ".chunk.tmp"]
+		before = sum(os.path.getsize(self.settings.framepath(i)) for i in range(start,stop))
+		
+		#One decode of the files makes the chunk and hashes every frame, then the chunk is
+		#decoded and hashed on its own. Both as rgba, which holds any frame's pixels
+		count = ["-frames:v",str(stop - start)]
+		ffmpeg.run(["ffmpeg","-y","-loglevel","error","-framerate",str(chunkrate),"-start_number",str(start),"-i",self.settings.framepattern()]
+			+ ["-map","0:v"] + count + chunkoptions + ["-threads","1","-f","matroska",temp]
+			+ ["-map","0:v"] + count + ["-pix_fmt","rgba","-f","framemd5",sums[0]],background=True)
+		ffmpeg.run(["ffmpeg","-y","-loglevel","error","-i",temp,"-pix_fmt","rgba","-f","framemd5",sums[1]],background=True)
+		
+		try:
+			source,chunk = [framesums(name) for name in sums]
+		finally:
+			for name in sums:
+				os.remove(name)
+				
+		if len(source) != stop - start or chunk != source:
+			os.remove(temp)
+			raise RuntimeError("the chunk doesn't decode to the same frames")
+			
+		#On disk for sure before the files it replaces are gone
+		with open(temp,"r+b") as f:
+			os.fsync(f.fileno())
+		os.replace(temp,path)
+		
+		self.moved(start,stop,path)
+		
+		after = os.path.getsize(path)
+		self.saved += before - after
+		log.info("Compacted frames %d to %d%s, %.1f MB down to %.1f MB", start, stop - 1,
+			"" if self.settings.name == None else " of " + self.settings.name, before / 1048576, after / 1048576)
+			
+	#Point the index at the frames of a chunk, then delete their files
+	def moved(self,start,stop,path):
+		
+		self.index.relocate([(path,i - start,i) for i in range(start,stop)])
+		
+		for i in range(start,stop):
+			try:
+				os.remove(self.settings.framepath(i))
+			except FileNotFoundError:
+				pass
+
+def chunkpath(folder,start,stop):
+	return os.path.join(folder,"chunks","chunk_{:06d}_{:06d}.mkv".format(start,stop))
+
+#(start,stop,path) of every chunk of the recording in folder, holding frames start to stop
+def chunks(folder):
+	
+	found = []
+	for path in glob.glob(os.path.join(folder,"chunks","chunk_*.mkv")):
+		match = re.fullmatch(r"chunk_(\d+)_(\d+)\.mkv",os.path.basename(path))
+		if match != None:
+			found.append((int(match.group(1)),int(match.group(2)),path))
+	return sorted(found)
+
+#Whether some frames of the recording in folder are in chunks
+def compacted(folder):
+	return len(chunks(folder)) > 0
+
+#Compact every run of frames a compacted recording still has as files, which only an
+#interrupted recording or a failed compaction leaves behind
+def compactrest(settings):
+	
+	index = FrameIndex(settings.folder)
+	
+	try:
+		loose = [row["frame"] for row in index.select() if row["file"] != None and row["offset"] == None]
+		compactor = Compactor(settings,index)
+		
+		#Runs of consecutive frame numbers
+		for ignored,run in itertools.groupby(enumerate(loose),lambda pair: pair[1] - pair[0]):
+			run = [frame for ignored,frame in run]
+			compactor.compact(run[0],run[-1] + 1)
+	finally:
+		index.close()
+
+#The frame hashes in a framemd5 file, in order
+def framesums(path):
+	
+	with open(path) as f:
+		return [line.rsplit(",",1)[1].strip() for line in f if not line.startswith("#") and "," in line]
@@ -0,0 +1,511 @@
+#Exporting a finished recording, shared by the ui and the headless recorder.
+#The ui runs it as an ExportJob, so tk keeps running while ffmpeg works.
+
+import concurrent.futures
+import threading
+import hashlib
+import logging
+import shutil
+import queue
+import glob
+import json
+import time
+import os
+
+from lapse import store
+from lapse import journal
+from lapse import ffmpeg
+from lapse import manifest
+from lapse import index
+from lapse import compact
+from lapse.settings import Settings
+from lapse.segment import concat, concat_segments
+
+log = logging.getLogger("screenlapse")
+
+#Encode count loose frame files matching pattern, from frame start on, into a video.
+#extra are ffmpeg output options, job follows the progress (see lapse.ffmpeg.run)
+def encodeframes(pattern,fps,output,start=0,count=None,extra=None,job=None):
+	
+	command = ["ffmpeg","-y","-loglevel","error","-framerate",str(fps),"-start_number",str(start),"-i",pattern]
+	if count != None:
+		command += ["-frames:v",str(count)]
+	command += extra or []
+	command.append(output)
+	
+	ffmpeg.run(command,job=job)
+	
+#Encode the frames in rows (lapse.index rows) through a manifest, each shown for as long
+#as settings.export_timing says, or for seconds when given
+def encodemanifest(settings,rows,fps,output,extra=None,job=None,seconds=None):
+	
+	if seconds == None:
+		seconds = manifest.durations([row["time"] for row in rows],fps,settings.export_timing)
+		
+	listing = os.path.join(settings.folder,os.path.basename(output) + ".ffconcat")
+	manifest.write(listing,settings.folder,rows,seconds)
+	
+	#vfr keeps every frame exactly as long as the manifest says, instead of duplicating or
+	#dropping frames to fit a constant rate
+	command = ["ffmpeg","-y","-loglevel","error"] + manifest.inputoptions(settings,listing) + ["-vsync","vfr"]
+	command += extra or []
+	command.append(output)
+	
+	try:
+		ffmpeg.run(command,job=job)
+	finally:
+		os.remove(listing)
+		
+#Exports with real timing or only some of the frames go through a manifest of the index,
+#and so do compacted recordings, which have frames in chunks
+def usesmanifest(settings):
+	return settings.export_timing != "even" or len(settings.export_select) > 0 or compact.compacted(settings.folder)
+
+#Index rows of the frames settings.export_select picks
+def selectframes(settings):
+	
+	if not os.path.exists(os.path.join(settings.folder,"index.sqlite")):
+		raise RuntimeError("Exporting by capture time or a selection of frames needs the frame index")
+	
+	rows = index.select(settings.folder,**settings.export_select)
+	if len(rows) == 0:
+		raise RuntimeError("No frames match the selection")
+	return rows
+
+#Frames the export of the recording made with settings will encode
+def countframes(settings):
+	
+	if cacheable(settings) and len(settings.export_select) > 0:
+		return countframes(plain(settings))
+	
+	if usesmanifest(settings):
+		return len(selectframes(settings))
+	
+	if settings.storage == "container":
+		reader = store.FrameReader(settings.folder)
+		try:
+			return len(reader)
+		finally:
+			reader.close()
+			
+	session = journal.load(settings.folder)
+	if session != None:
+		return session.frames
+	return len(glob.glob(os.path.join(settings.folder,"img_*." + settings.framecodec().extension)))
+
+#Split frames 0 to count into at most parts contiguous (start,stop) ranges of about equal size
+def splitrange(count,parts):
+	
+	parts = max(1,min(parts,count))
+	ranges = []
+	start = 0
+	for i in range(parts):
+		stop = start + (count - start) // (parts - i)
+		ranges.append((start,stop))
+		start = stop
+	return ranges
+
+#Encode frames start to stop (of rows, shown for seconds, if given) into their own video
+def encodepart(settings,fps,output,start,stop,extra,job,rows=None,seconds=None):
+	
+	if rows != None:
+		encodemanifest(settings,rows[start:stop],fps,output,extra,job,seconds[start:stop])
+	elif settings.storage == "container":
+		store.export(settings.folder,settings.framecodec(),fps,output,start,stop,extra,job)
+	else:
+		encodeframes(settings.framepattern(),fps,output,start,stop - start,extra,job)
+
+#Encode the recording as workers parts at once and stream copy them together. Every part
+#is its own encode, so every part starts on a keyframe and the joins need no re-encode.
+#extra are more ffmpeg output options for every part
+def parallelexport(settings,output,fps,workers,job=None,rows=None,extra=None):
+	
+	if rows == None and usesmanifest(settings):
+		rows = selectframes(settings)
+		
+	count = countframes(settings) if rows == None else len(rows)
+	if count == 0:
+		raise RuntimeError("No frames were recorded")
+	
+	ranges = splitrange(count,workers)
+	
+	#Real timing scales every gap against the mean gap of the whole recording, not of a part
+	shown = None
+	if rows != None:
+		shown = manifest.durations([row["time"] for row in rows],fps,settings.export_timing)
+		
+	#Split the cores between the encoders, instead of every one of them starting a thread per core
+	extra = ["-threads",str(max(1,(os.cpu_count() or 1) // len(ranges)))] + (extra or [])
+	
+	folder = os.path.join(settings.folder,"parts")
+	shutil.rmtree(folder,ignore_errors=True)
+	os.makedirs(folder)
+	parts = [os.path.join(folder,"part_{:03d}.mp4".format(i)) for i in range(len(ranges))]
+	
+	began = time.perf_counter()
+	
+	try:
+		#ffmpeg does the work, so threads are enough to wait on it
+		with concurrent.futures.ThreadPoolExecutor(len(ranges)) as pool:
+			futures = [pool.submit(encodepart,settings,fps,parts[i],ranges[i][0],ranges[i][1],extra,job,rows,shown) for i in range(len(ranges))]
+			for future in futures:
+				future.result()
+			
+		#The frames were counted while encoding the parts
+		concat(parts,os.path.join(folder,"list.txt"),output,job,False)
+		seconds = time.perf_counter() - began
+	finally:
+		shutil.rmtree(folder,ignore_errors=True)
+	
+	return {"video":output,"parts":len(ranges),"seconds":seconds}
+
+#Export the recording made with settings, the cheapest way its mode and storage allow.
+#Returns the video, how many parts it was encoded in and how long that took. job follows
+#the progress (see lapse.ffmpeg.run)
+def export(settings,output,fps=None,job=None):
+	
+	if fps == None:
+		fps = settings.fps
+		
+	if settings.mode == "stream":
+		raise RuntimeError("Streamed recordings are already saved to " + settings.video)
+	
+	if job != None:
+		job.video = output
+		
+	began = time.perf_counter()
+	
+	#A concat list can't mix chunks with image files
+	if compact.compacted(settings.folder):
+		compact.compactrest(settings)
+		
+	if len(settings.renditions) > 0:
+		outputs = renditionexport(settings,fps,job)
+		return {"video":", ".join(outputs),"parts":1,"seconds":time.perf_counter() - began}
+		
+	try:
+		if cacheable(settings):
+			return cachedexport(settings,output,fps,job)
+		elif usesmanifest(settings):
+			rows = selectframes(settings)
+			if settings.export_workers > 1:
+				return parallelexport(settings,output,fps,settings.export_workers,job,rows)
+			encodemanifest(settings,rows,fps,output,job=job)
+		#Segments were encoded at the recording FPS, any other FPS needs a full encode
+		elif settings.mode == "segments" and fps == settings.fps:
+			concat_segments(settings.folder,output,job)
+		elif settings.export_workers > 1:
+			return parallelexport(settings,output,fps,settings.export_workers,job)
+		elif settings.storage == "container":
+			store.export(settings.folder,settings.framecodec(),fps,output,job=job)
+		else:
+			encodeframes(settings.framepattern(),fps,output,job=job)
+	except ffmpeg.Cancelled:
+		#Don't leave half a video behind
+		if os.path.exists(output):
+			os.remove(output)
+		raise
+		
+	return {"video":output,"parts":1,"seconds":time.perf_counter() - began}
+
+#Export every region of a recording to its own video, returns what export returned for each
+def exportall(settings,fps=None,job=None):
+	
+	return [export(regionsettings,regionsettings.video,fps,job) for regionsettings in settings.regionsettings()]
+
+#Renditions. One ffmpeg reads and decodes the frames once, splits them and scales and
+#encodes every rendition from the same decoded frames, instead of one full pass per video.
+#Default codec and the pixel format filter by extension, gif gets a palette of its own
+formats = {
+	".mp4":("libx264","format=yuv420p"),
+	".mkv":("libx264","format=yuv420p"),
+	".mov":("libx264","format=yuv420p"),
+	".webm":("libvpx-vp9","format=yuv420p"),
+	".webp":("libwebp",None),
+	".gif":(None,None),
+}
+
+#ffmpeg input options that read the frames an export of settings wants, the feed(stdin)
+#they need, if any, and a function cleaning up after
+def frameinput(settings,fps):
+	
+	if usesmanifest(settings):
+		rows = selectframes(settings)
+		listing = os.path.join(settings.folder,"renditions.ffconcat")
+		manifest.write(listing,settings.folder,rows,manifest.durations([row["time"] for row in rows],fps,settings.export_timing))
+		return manifest.inputoptions(settings,listing),None,lambda: os.remove(listing)
+		
+	#Segments are already encoded at the recording FPS, they play at that rate
+	if settings.mode == "segments":
+		segments = sorted(glob.glob(os.path.join(settings.folder,"segments","seg_*.mp4")))
+		if len(segments) == 0:
+			raise RuntimeError("No segments were recorded")
+		listing = os.path.join(settings.folder,"segments","renditions.txt")
+		with open(listing,"w") as f:
+			for segment in segments:
+				f.write(manifest.fileline(os.path.abspath(segment)))
+		return ["-f","concat","-safe","0","-i",listing],None,lambda: os.remove(listing)
+		
+	if settings.storage == "container":
+		reader = store.FrameReader(settings.folder)
+		if len(reader) == 0:
+			reader.close()
+			raise RuntimeError("No frames were recorded")
+		return ["-f",settings.framecodec().pipe,"-framerate",str(fps),"-i","-"],reader.writeframes,reader.close
+		
+	return ["-framerate",str(fps),"-start_number","0","-i",settings.framepattern()],None,lambda: None
+
+#Export every rendition in settings.renditions in a single pass, returns their files
+def renditionexport(settings,fps,job=None):
+	
+	renditions = settings.renditions
+	outputs = [rendition["output"] for rendition in renditions]
+	if job != None:
+		job.video = ", ".join(outputs)
+		
+	inputs,feed,cleanup = frameinput(settings,fps)
+	
+	graph = ["[0:v]split={}".format(len(renditions)) + "".join("[s{}]".format(i) for i in range(len(renditions)))]
+	options = []
+	
+	for i,rendition in enumerate(renditions):
+		
+		extension = os.path.splitext(rendition["output"])[1].lower()
+		codec,pixels = formats.get(extension,(None,None))
+		
+		#Cut in the graph, so nothing past the end is ever scaled, or buffered for a gif palette
+		#that would otherwise only be made once the whole recording went through
+		chain = []
+		if rendition["seconds"] != None:
+			chain += ["trim=duration={:g}".format(rendition["seconds"]),"setpts=PTS-STARTPTS"]
+		if rendition["fps"] != None:
+			chain.append("fps={:g}".format(rendition["fps"]))
+		if rendition["size"] != None:
+			width,height = rendition["size"]
+			chain.append("scale={}:{}:flags=lanczos".format(width,height))
+			
+		if extension == ".gif":
+			#A palette from this rendition's own frames, the default one bands badly
+			graph.append("[s{0}]{1}split[g{0}][p{0}];[p{0}]palettegen[q{0}];[g{0}][q{0}]paletteuse[o{0}]".format(i,"".join(filter + "," for filter in chain)))
+		else:
+			if pixels != None:
+				chain.append(pixels)
+			graph.append("[s{}]{}[o{}]".format(i,",".join(chain) or "null",i))
+			
+		options += ["-map","[o{}]".format(i)]
+		if usesmanifest(settings):
+			options += ["-vsync","vfr"]
+		if rendition["codec"] != None or codec != None:
+			options += ["-c:v",rendition["codec"] or codec]
+		if rendition["bitrate"] != None:
+			options += ["-b:v",rendition["bitrate"]]
+		if extension == ".webp":
+			options += ["-loop","0"]
+		#Only a guard, the trim already ended this rendition
+		if rendition["seconds"] != None:
+			options += ["-t","{:g}".format(rendition["seconds"])]
+		options.append(rendition["output"])
+		
+	command = ["ffmpeg","-y","-loglevel","error"] + inputs + ["-filter_complex",";".join(graph)] + options
+	
+	try:
+		ffmpeg.run(command,feed,job)
+	except ffmpeg.Cancelled:
+		for output in outputs:
+			if os.path.exists(output):
+				os.remove(output)
+		raise
+	finally:
+		cleanup()
+		
+	return outputs
+
+#One line summary of exportall's results
+def describe(results):
+	
+	text = "Saved " + ", ".join(result["video"] for result in results)
+	seconds = sum(result["seconds"] for result in results)
+	text += " in {:.1f}s".format(seconds)
+	
+	if any(result.get("cached") for result in results):
+		text += " from the export cache"
+	elif any(result["parts"] > 1 for result in results):
+		#How much that saved over a single pass is only known from measuring both, see lapse.bench
+		text += ", encoded as {} parts at once".format(max(result["parts"] for result in results))
+	return text
+
+#The export cache. The first export encodes every frame at high quality and all intra (every
+#frame a keyframe) into cache/ in the recording folder. Exports that only change the FPS or
+#the frame range are then cut from it with stream copy and rescaled timestamps, which takes
+#seconds instead of a full encode
+cacheoptions = ["-c:v","libx264","-preset","veryfast","-crf","16","-g","1","-pix_fmt","yuv420p"]
+
+#Whether the export settings asks for can come from the cache: all frames or a contiguous
+#range of them, shown equally long
+def cacheable(settings):
+	return settings.export_cache and settings.export_timing == "even" and "minchange" not in settings.export_select
+
+#A copy of settings that exports every frame, evenly
+def plain(settings):
+	
+	settings = Settings.fromdict(settings.todict())
+	settings.export_timing = "even"
+	settings.export_select = {}
+	return settings
+
+#Names the frames of a recording and how the cache encodes them. With the frame index that's
+#the content hash of every frame, without it the sizes and times of the stored files
+def cachekey(settings):
+	
+	digest = hashlib.blake2b(json.dumps(cacheoptions).encode(),digest_size=12)
+	
+	if os.path.exists(os.path.join(settings.folder,"index.sqlite")):
+		for row in index.select(settings.folder):
+			digest.update("{} {}\n".format(row["frame"],row["hash"] or row["size"]).encode())
+	else:
+		paths = [os.path.join(settings.folder,"frames.dat")]
+		if settings.storage == "files":
+			paths = sorted(glob.glob(os.path.join(settings.folder,"img_*." + settings.framecodec().extension)))
+		for path in paths:
+			stat = os.stat(path)
+			digest.update("{} {} {}\n".format(os.path.basename(path),stat.st_size,stat.st_mtime_ns).encode())
+			
+	return digest.hexdigest()
+
+#Frames [start,stop) export_select asks for
+def framerange(settings,count):
+	
+	select = settings.export_select
+	if "since" in select or "until" in select:
+		rows = selectframes(settings)
+		return rows[0]["frame"],rows[-1]["frame"] + 1
+	
+	return max(0,select.get("start",0)),min(count,select.get("stop",count))
+
+def cachedexport(settings,output,fps,job=None):
+	
+	began = time.perf_counter()
+	
+	folder = os.path.join(settings.folder,"cache")
+	key = cachekey(settings)
+	cache = os.path.join(folder,key + ".mp4")
+	infopath = os.path.join(folder,key + ".json")
+	cached = os.path.exists(infopath)
+	
+	if cached:
+		with open(infopath) as f:
+			info = json.load(f)
+	else:
+		#A recording only ever needs the cache of its latest frames
+		shutil.rmtree(folder,ignore_errors=True)
+		os.makedirs(folder)
+		
+		everything = plain(settings)
+		if settings.export_workers > 1:
+			parallelexport(everything,cache,fps,settings.export_workers,job,None,cacheoptions)
+		elif usesmanifest(everything):
+			encodemanifest(everything,selectframes(everything),fps,cache,cacheoptions,job)
+		elif settings.storage == "container":
+			store.export(settings.folder,settings.framecodec(),fps,cache,extra=cacheoptions,job=job)
+		else:
+			encodeframes(settings.framepattern(),fps,cache,extra=cacheoptions,job=job)
+			
+		#Written last, so a cache without it is never used
+		info = {"fps":fps,"frames":countframes(everything)}
+		with open(infopath,"w") as f:
+			json.dump(info,f)
+			
+	start,stop = framerange(settings,info["frames"])
+	if stop <= start:
+		raise RuntimeError("No frames match the selection")
+	
+	#Frame n of the cache is at n / cache fps, it has to end up at n / fps. Every frame is a
+	#keyframe, so the cut lands exactly on frame start (half a frame early, against rounding)
+	command = ["ffmpeg","-y","-loglevel","error","-itsscale",repr(info["fps"] / fps),"-i",cache]
+	if start > 0:
+		command += ["-ss",repr((start - 0.5) / fps)]
+	command += ["-frames:v",str(stop - start),"-c","copy","-avoid_negative_ts","make_zero",output]
+	
+	#Only frames encoded into the cache count, copying them is next to free
+	ffmpeg.run(command,job=job,counted=False)
+	
+	return {"video":output,"parts":1,"seconds":time.perf_counter() - began,"cached":cached}
+
+#exportall on its own thread. Posts (kind,info) tuples on progress like the capture worker:
+#"progress" while encoding, then one of "done", "error" or "cancelled"
+class ExportJob(threading.Thread):
+	
+	def __init__(self,settings,fps=None):
+		
+		threading.Thread.__init__(self,daemon=True)
+		
+		self.settings = settings
+		self.fps = fps
+		self.progress = queue.Queue()
+		self.cancelled = False
+		
+		#Running ffmpeg processes and their frames done, and frames of those that finished
+		self.lock = threading.Lock()
+		self.processes = {}
+		self.done = 0
+		self.total = 0
+		self.video = None
+		self.began = None
+		
+	#Kill whatever ffmpeg is running, the job then ends with "cancelled"
+	def cancel(self):
+		
+		with self.lock:
+			self.cancelled = True
+			processes = list(self.processes)
+			
+		for process in processes:
+			process.terminate()
+			
+	def run(self):
+		
+		self.began = time.monotonic()
+		
+		try:
+			self.total = sum(countframes(regionsettings) for regionsettings in self.settings.regionsettings())
+			results = exportall(self.settings,self.fps,self)
+		except ffmpeg.Cancelled:
+			self.progress.put(("cancelled",{}))
+		except Exception as e:
+			log.exception("Export failed")
+			self.progress.put(("error",{"message":str(e)}))
+		else:
+			self.progress.put(("done",{"results":results}))
+			
+	#Called by lapse.ffmpeg.run, from whichever thread runs the process
+	def started(self,process):
+		
+		with self.lock:
+			self.processes[process] = 0
+			if self.cancelled:
+				process.terminate()
+				
+	def update(self,process,frames):
+		
+		with self.lock:
+			self.processes[process] = frames
+			self.report()
+			
+	def finished(self,process,frames):
+		
+		with self.lock:
+			del self.processes[process]
+			self.done += frames
+			self.report()
+			
+	def report(self):
+		
+		frames = self.done + sum(self.processes.values())
+		elapsed = time.monotonic() - self.began
+		fps = frames / elapsed if elapsed > 0 else 0.0
+		
+		eta = None
+		if fps > 0:
+			eta = max(0,self.total - frames) / fps
+			
+		self.progress.put(("progress",{"video":self.video,"frames":frames,"total":self.total,"fps":fps,"eta":eta}))
@@ -0,0 +1,84 @@
+#Running ffmpeg as a managed subprocess: arguments as a list (never through a shell),
+#stdin fed from a thread, stderr kept for the error report, and -progress parsed
+#for whoever is watching.
+
+import threading
+import subprocess
+import os
+
+class Cancelled(Exception):
+	pass
+
+#Run command, an ffmpeg argument list, to the end. feed(stdin) writes its input, if it has any.
+#job (see lapse.export.ExportJob) is told about the process and its progress, and can
+#kill it. Frames done only count towards the job's total if counted. A background run
+#gets a lower priority, so it doesn't compete with capturing
+def run(command,feed=None,job=None,counted=True,background=False):
+	
+	if job != None:
+		if job.cancelled:
+			raise Cancelled()
+		command = command[:1] + ["-progress","pipe:1","-nostats"] + command[1:]
+		
+	process = subprocess.Popen(command,
+		stdin=subprocess.PIPE if feed != None else subprocess.DEVNULL,
+		stdout=subprocess.PIPE if job != None else subprocess.DEVNULL,
+		stderr=subprocess.PIPE,
+		bufsize=0,
+		creationflags=subprocess.BELOW_NORMAL_PRIORITY_CLASS if background and os.name == "nt" else 0)
+		
+	#Lowered from here, preexec_fn can deadlock the child while other threads are running
+	if background and os.name != "nt":
+		try:
+			os.setpriority(os.PRIO_PROCESS,process.pid,10)
+		except OSError:
+			#Already gone, its exit status tells how it went
+			pass
+			
+	if job != None:
+		job.started(process)
+		
+	#Drain stderr and stdin on their own threads, so neither pipe can fill up and stall ffmpeg
+	errors = []
+	threads = [threading.Thread(target=lambda: errors.append(process.stderr.read()),daemon=True)]
+	if feed != None:
+		threads.append(threading.Thread(target=writeinput,args=(process,feed),daemon=True))
+	for thread in threads:
+		thread.start()
+		
+	frames = 0
+	try:
+		if job != None:
+			values = {}
+			for line in process.stdout:
+				key,ignored,value = line.decode(errors="replace").strip().partition("=")
+				values[key] = value
+				#Every block of values ends with progress=continue or progress=end
+				if key == "progress":
+					frames = int(values.get("frame","0") or 0)
+					if counted:
+						job.update(process,frames)
+					values = {}
+					
+		process.wait()
+		for thread in threads:
+			thread.join()
+	finally:
+		if job != None:
+			job.finished(process,frames if counted else 0)
+			
+	if job != None and job.cancelled:
+		raise Cancelled()
+		
+	if process.returncode != 0:
+		error = b"".join(errors).decode(errors="replace").strip()
+		raise RuntimeError("ffmpeg exited with " + str(process.returncode) + ": " + error)
+
+def writeinput(process,feed):
+	
+	try:
+		feed(process.stdin)
+		process.stdin.close()
+	except (BrokenPipeError,ValueError):
+		#ffmpeg stopped reading, its exit status tells why
+		pass
@@ -0,0 +1,253 @@
+#Headless recorder, for recording without any window (over ssh, on a Xvfb session,
+#on a kiosk...). Uses the same capture worker and export as the ui, without loading tk.
+#
+#	python -m lapse.headless --offset 1920,0 --size 1920x1080 --spm 6 --fps 2 --output video.mp4
+#
+#Recording stops on SIGINT/SIGTERM, after --duration seconds, or once the --control file
+#contains "stop". The video is exported right after, unless --no-export is given.
+#
+#If the last recording in --folder was interrupted, --resume carries on with it and
+#--export-only exports it. Otherwise it is kept, and nothing is recorded.
+
+import argparse
+import logging
+import signal
+import queue
+import time
+import os
+
+from lapse.settings import Settings
+from lapse.settings import parseregions, parserenditions, parsemask
+from lapse.worker import CaptureWorker
+from lapse import export
+from lapse import journal
+
+log = logging.getLogger("screenlapse")
+
+def parsepair(text,separator):
+	
+	a,b = text.lower().split(separator)
+	return (int(a),int(b))
+
+def parseargs():
+	
+	defaults = Settings()
+	
+	parser = argparse.ArgumentParser(description="Record a screen lapse without the ui")
+	parser.add_argument("--offset",default="0,0",help="x,y of the recorded area")
+	parser.add_argument("--size",default="1920x1080",help="WxH of the recorded area")
+	parser.add_argument("--region",action="append",default=[],help="name:x,y,WxH[>WxH], record this region into its own video, can be given several times")
+	parser.add_argument("--output-size",help="WxH to scale frames to right after grabbing, default is --size")
+	parser.add_argument("--spm",type=float,default=defaults.spm,help="shots per minute")
+	parser.add_argument("--adaptive",action="store_true",help="move the shot rate between --spm-min and --spm-max with screen activity")
+	parser.add_argument("--spm-min",type=float,default=defaults.spm_min)
+	parser.add_argument("--spm-max",type=float,default=defaults.spm_max)
+	parser.add_argument("--fps",type=float,help="frames per second of the video (default %s, or what --export-only recorded with)" % defaults.fps)
+	parser.add_argument("--output",default=defaults.video,help="video to export to")
+	parser.add_argument("--folder",default=defaults.folder,help="folder for the recorded frames")
+	parser.add_argument("--mode",default=defaults.mode,choices=["frames","stream","segments"])
+	parser.add_argument("--segment-frames",type=int,default=defaults.segment_frames,help="frames per segment in --mode segments")
+	parser.add_argument("--codec",default=defaults.codec,help="frame codec, see lapse.codec")
+	parser.add_argument("--storage",default=defaults.storage,choices=["files","container"])
+	parser.add_argument("--backend",default=defaults.backend,help="capture backend, or auto")
+	parser.add_argument("--writers",type=int,default=defaults.writers)
+	parser.add_argument("--backpressure",default=defaults.backpressure,choices=["block","drop","slow"])
+	parser.add_argument("--min-change",type=float,default=0.0,help="skip shots where less than this percent changed")
+	parser.add_argument("--change-mask",action="append",default=[],help="x,y,WxH, ignore this box of the frame when looking for changes, like a clock, can be given several times")
+	parser.add_argument("--duration",type=float,help="stop after this many seconds")
+	parser.add_argument("--control",help="stop once this file contains \"stop\"")
+	parser.add_argument("--pidfile",help="write the process id here while recording")
+	parser.add_argument("--resume",action="store_true",help="continue an interrupted recording in --folder")
+	parser.add_argument("--quota",type=int,default=0,help="MB of disk for the frames, once full every other frame is thinned out (0 for no limit)")
+	parser.add_argument("--compact",action="store_true",help="fold stored frame files into lossless video chunks while recording, needs --mode frames and --storage files")
+	parser.add_argument("--compact-frames",type=int,default=defaults.compact_frames,help="frames per --compact chunk")
+	parser.add_argument("--no-index",action="store_true",help="don't keep a frame index (see python -m lapse.index)")
+	parser.add_argument("--metrics-log",default=defaults.metrics_log,help="per frame stage timings file in --folder, .csv or .jsonl, empty for none")
+	parser.add_argument("--metrics-port",type=int,help="serve Prometheus metrics on this localhost port")
+	parser.add_argument("--export-workers",type=int,default=1,help="ffmpeg encoders exporting parts of the video at once")
+	parser.add_argument("--timing",default=defaults.export_timing,choices=["even","real"],help="show exported frames equally long, or spaced like they were captured")
+	parser.add_argument("--start-frame",type=int,help="export from this frame on")
+	parser.add_argument("--stop-frame",type=int,help="export up to this frame")
+	parser.add_argument("--since",type=float,help="export frames captured at or after this unix time")
+	parser.add_argument("--until",type=float,help="export frames captured before this unix time")
+	parser.add_argument("--busy",type=float,help="export only frames where at least this fraction changed")
+	parser.add_argument("--rendition",action="append",default=[],help="file:WxH[,codec][,bitrate][,Nfps][,Ns], export this video instead of --output, all renditions in one pass, can be given several times")
+	parser.add_argument("--cache",action="store_true",help="export through the export cache, so exporting again at another --fps or frame range is only a copy")
+	parser.add_argument("--export-only",action="store_true",help="export the recording in --folder without recording")
+	parser.add_argument("--discard",action="store_true",help="start over even if a recording in --folder was interrupted")
+	parser.add_argument("--no-export",action="store_true",help="only record frames")
+	parser.add_argument("--quiet",action="store_true",help="only log warnings and errors")
+	return parser.parse_args()
+
+def readsettings(args):
+	
+	settings = Settings()
+	settings.offset = parsepair(args.offset,",")
+	settings.size = parsepair(args.size,"x")
+	if args.output_size:
+		settings.output_size = parsepair(args.output_size,"x")
+	settings.regions = parseregions(";".join(args.region))
+	settings.spm = args.spm
+	settings.adaptive = args.adaptive
+	settings.spm_min = args.spm_min
+	settings.spm_max = args.spm_max
+	if args.fps != None:
+		settings.fps = args.fps
+	settings.video = args.output
+	settings.folder = args.folder
+	settings.mode = args.mode
+	settings.segment_frames = max(1,args.segment_frames)
+	settings.codec = args.codec
+	settings.storage = args.storage
+	settings.backend = args.backend
+	settings.writers = max(1,args.writers)
+	settings.backpressure = args.backpressure
+	settings.change_threshold = args.min_change / 100
+	settings.change_mask = parsemask(";".join(args.change_mask))
+	settings.export_workers = max(1,args.export_workers)
+	settings.export_timing = args.timing
+	settings.export_cache = args.cache
+	settings.renditions = parserenditions(";".join(args.rendition))
+	settings.export_select = {}
+	for name,value in (("start",args.start_frame),("stop",args.stop_frame),("since",args.since),("until",args.until),("minchange",args.busy)):
+		if value != None:
+			settings.export_select[name] = value
+	settings.quota_mb = max(0,args.quota)
+	settings.frame_index = not args.no_index
+	settings.compact = args.compact
+	settings.compact_frames = max(1,args.compact_frames)
+	settings.metrics_log = args.metrics_log
+	settings.metrics_port = args.metrics_port
+	return settings
+
+def controlstop(path):
+	
+	try:
+		with open(path) as f:
+			return f.read().strip() == "stop"
+	except OSError:
+		return False
+	
+#Disk usage, and with --duration, what it will be at the end
+def disktext(info,settings,args):
+	
+	text = "%.1f MB on disk" % (info["disk_bytes"] / 1048576)
+	
+	if args.duration != None:
+		projected = info["disk_bytes"] + info["disk_hour"] * max(0,args.duration - info["elapsed"]) / 3600
+		if settings.quota_mb > 0:
+			projected = min(projected,settings.quota_mb * 1048576)
+		text += ", %.1f MB projected" % (projected / 1048576)
+		
+	return text
+
+def record(settings,args,resume=None):
+	
+	worker = CaptureWorker(settings,resume)
+	
+	#Only ask the worker to stop here, the loop below waits for it to finish
+	stop = lambda *ignored: worker.stop()
+	signal.signal(signal.SIGINT,stop)
+	signal.signal(signal.SIGTERM,stop)
+	
+	worker.start()
+	start = time.monotonic()
+	stopping = False
+	failed = False
+	
+	while True:
+		
+		try:
+			kind,info = worker.progress.get(timeout=1.0)
+		except queue.Empty:
+			kind,info = None,None
+			
+		if kind == "frame":
+			log.info("%sFrame %d, %.0fs, %d missed, %d held, %.1f spm, %s", (info["region"] + " ") if info["region"] else "", info["frame"], info["elapsed"], info["missed"], info["held"], info["spm"], disktext(info,settings,args))
+		elif kind == "thinned":
+			log.info("Thinned to every %dth shot", info["stride"])
+		elif kind == "backend":
+			log.info("Capturing with %s", info["name"])
+		elif kind == "error":
+			log.error("Capture failed: %s", info["message"])
+			failed = True
+		elif kind == "stopped":
+			return info["frames"],failed
+		
+		if stopping:
+			continue
+		
+		if args.duration != None and time.monotonic() - start >= args.duration:
+			stopping = True
+		elif args.control != None and controlstop(args.control):
+			stopping = True
+			
+		if stopping:
+			worker.stop()
+			
+def main():
+	
+	args = parseargs()
+	
+	logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,format="%(asctime)s %(message)s")
+	
+	settings = readsettings(args)
+	settings.framecodec()
+	
+	session = journal.load(settings.folder)
+	resume = None
+	
+	#Journaled recordings carry their own settings, the options only pick the output
+	if session != None and (args.export_only or (args.resume and not session.closed)):
+		options = settings
+		settings = session.settings
+		for name in ("video","export_workers","export_timing","export_select","export_cache","renditions"):
+			setattr(settings,name,getattr(options,name))
+		resume = None if session.closed else session
+		
+	if args.export_only:
+		if session == None:
+			log.error("No recording found in %s", args.folder)
+			raise SystemExit(1)
+		try:
+			log.info("%s", export.describe(export.exportall(settings,args.fps)))
+		except (RuntimeError,OSError) as e:
+			log.error("Export failed: %s", e)
+			raise SystemExit(1)
+		return
+	
+	#Recording over a finished recording would delete it
+	if args.resume and resume == None:
+		log.error("No interrupted recording to resume in %s", args.folder)
+		raise SystemExit(1)
+		
+	if resume == None and session != None and not session.closed and not args.discard:
+		log.error("The recording in %s was interrupted after %d frames, pass --resume, --export-only or --discard", args.folder, session.frames)
+		raise SystemExit(1)
+		
+	if args.pidfile:
+		with open(args.pidfile,"w") as f:
+			f.write(str(os.getpid()) + "\n")
+			
+	try:
+		frames,failed = record(settings,args,resume)
+	finally:
+		if args.pidfile:
+			os.remove(args.pidfile)
+			
+	log.info("Recorded %d frames", frames)
+	
+	if settings.mode == "stream":
+		log.info("Saved %s", ", ".join(regionsettings.video for regionsettings in settings.regionsettings()))
+	elif frames > 0 and not args.no_export:
+		try:
+			log.info("%s", export.describe(export.exportall(settings)))
+		except (RuntimeError,OSError) as e:
+			log.error("Export failed: %s", e)
+			failed = True
+		
+	if failed:
+		raise SystemExit(1)
+	
+if __name__ == "__main__":
+	main()
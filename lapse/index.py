@@ -0,0 +1,173 @@
+#Frame index. Every stored frame gets a row in index.sqlite in its recording folder, with
+#its capture time, a content hash of its pixels, a perceptual hash, how much of it changed
+#since the frame before, and where it is stored. Rows are written in batches from the
+#writer pool's feeder thread, so indexing never waits on disk per frame.
+#
+#Tools can then pick frames by number, time or activity without opening a single image:
+#
+#	python -m lapse.index output --since 1700000000 --min-change 0.05
+
+import threading
+import argparse
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+from PIL import Image
+
+schema = """
+create table if not exists frames (
+	frame integer primary key,
+	time real not null,
+	hash text,
+	phash text,
+	change real,
+	file text,
+	offset integer,
+	size integer
+);
+create index if not exists frames_time on frames (time);
+"""
+
+columns = ["frame","time","hash","phash","change","file","offset","size"]
+
+#(content hash, perceptual hash) of a frame. The content hash only matches identical
+#pixels, the perceptual one (a difference hash) stays close for similar looking frames.
+#Runs in the encoder processes
+def framehashes(image,pixels):
+	
+	content = hashlib.blake2b(pixels,digest_size=16).hexdigest()
+	
+	#reducing_gap shrinks by whole blocks first, so this never touches every pixel twice
+	small = image.resize((9,8),Image.BOX,reducing_gap=2.0).convert("L").tobytes()
+	bits = 0
+	for y in range(8):
+		for x in range(8):
+			bits = (bits << 1) | (small[y * 9 + x] > small[y * 9 + x + 1])
+			
+	return content,"{:016x}".format(bits)
+
+class FrameIndex():
+	
+	def __init__(self,folder,batchframes=50,batchseconds=5.0):
+		
+		self.path = os.path.join(folder,"index.sqlite")
+		self.batchframes = batchframes
+		self.batchseconds = batchseconds
+		
+		#Opened by the capture worker, written from the feeder thread and the compactor,
+		#one at a time
+		self.db = sqlite3.connect(self.path,check_same_thread=False)
+		self.lock = threading.RLock()
+		self.db.executescript(schema)
+		
+		self.pending = []
+		self.lastcommit = time.monotonic()
+		
+	def add(self,frame,timestamp,hashes,change,path,offset,size):
+		
+		content,perceptual = hashes or (None,None)
+		
+		with self.lock:
+			self.pending.append((frame,timestamp,content,perceptual,change,path,offset,size))
+			
+			if len(self.pending) >= self.batchframes or time.monotonic() - self.lastcommit >= self.batchseconds:
+				self.commit()
+				
+	def commit(self):
+		
+		with self.lock:
+			if len(self.pending) > 0:
+				self.db.executemany("insert or replace into frames values (?,?,?,?,?,?,?,?)",self.pending)
+				self.db.commit()
+				self.pending = []
+			self.lastcommit = time.monotonic()
+			
+	#Frames moved into a lapse.compact chunk. locations are (chunk,position in it,frame)
+	def relocate(self,locations):
+		
+		with self.lock:
+			self.commit()
+			self.db.executemany("update frames set file = ?, offset = ? where frame = ?",locations)
+			self.db.commit()
+		
+	#Forget frames from count on, for resuming from the journal
+	def truncate(self,count):
+		
+		self.commit()
+		self.db.execute("delete from frames where frame >= ?",(count,))
+		self.db.commit()
+		
+	#Match a thinning of the frames: keep the even frames, renumbered to half.
+	#locate(frame) gives the new (file,offset) of a frame
+	def thin(self,locate):
+		
+		self.commit()
+		self.db.execute("delete from frames where frame % 2 = 1")
+		#Through negative numbers, so no renumbered frame collides with one not moved yet
+		self.db.execute("update frames set frame = -1 - frame / 2")
+		self.db.execute("update frames set frame = -1 - frame")
+		
+		rows = self.db.execute("select frame from frames").fetchall()
+		self.db.executemany("update frames set file = ?, offset = ? where frame = ?",[locate(frame) + (frame,) for frame, in rows])
+		self.db.commit()
+		
+	#Rows of the frames so far, see select()
+	def select(self,**filters):
+		
+		self.commit()
+		return query(self.db,**filters)
+		
+	def close(self):
+		
+		with self.lock:
+			self.commit()
+			self.db.close()
+
+#Rows of the index in folder as dicts, in frame order. Every filter is optional: frames
+#start to stop, captured between since and until (unix time), and at least minchange changed
+def select(folder,**filters):
+	
+	db = sqlite3.connect(os.path.join(folder,"index.sqlite"))
+	try:
+		return query(db,**filters)
+	finally:
+		db.close()
+
+def query(db,start=None,stop=None,since=None,until=None,minchange=None):
+	
+	conditions = []
+	values = []
+	for condition,value in (("frame >= ?",start),("frame < ?",stop),("time >= ?",since),("time < ?",until),("change >= ?",minchange)):
+		if value != None:
+			conditions.append(condition)
+			values.append(value)
+			
+	text = "select " + ", ".join(columns) + " from frames"
+	if len(conditions) > 0:
+		text += " where " + " and ".join(conditions)
+	text += " order by frame"
+	
+	return [dict(zip(columns,row)) for row in db.execute(text,values)]
+
+def main():
+	
+	parser = argparse.ArgumentParser(description="List frames of a screenlapse recording from its index")
+	parser.add_argument("folder",help="recording folder, or a region's folder in it")
+	parser.add_argument("--start",type=int,help="first frame")
+	parser.add_argument("--stop",type=int,help="frame to stop before")
+	parser.add_argument("--since",type=float,help="captured at or after this unix time")
+	parser.add_argument("--until",type=float,help="captured before this unix time")
+	parser.add_argument("--min-change",type=float,help="changed at least this fraction since the frame before")
+	args = parser.parse_args()
+	
+	if not os.path.exists(os.path.join(args.folder,"index.sqlite")):
+		raise SystemExit("No frame index in " + args.folder)
+		
+	for row in select(args.folder,start=args.start,stop=args.stop,since=args.since,until=args.until,minchange=args.min_change):
+		print(json.dumps(row))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,135 @@
+#Session journal. Every stored frame is appended to output/journal.jsonl as one json
+#line (index, capture timestamp, file or store offset, size), after a header line with
+#the recording settings. Lines are fsynced in batches, so a crash loses at most one
+#batch. A journal without a closing line belongs to an interrupted recording, which
+#load() picks up without looking at any frame.
+#
+#onsync is called before every journal sync, to get the frames themselves onto disk
+#first, so the journal never claims a frame that a crash could still take away.
+
+import json
+import time
+import os
+
+from lapse.settings import Settings
+
+class Journal():
+	
+	def __init__(self,folder,syncframes=10,syncseconds=5.0,onsync=None):
+		
+		self.path = os.path.join(folder,"journal.jsonl")
+		self.syncframes = syncframes
+		self.syncseconds = syncseconds
+		self.onsync = onsync
+		
+		self.file = None
+		self.unsynced = 0
+		self.lastsync = time.monotonic()
+		
+	def create(self,settings):
+		
+		self.file = open(self.path,"w")
+		self.write({"settings":settings.todict(),"started":time.time()})
+		self.sync()
+		
+	#Keep appending to the journal of an interrupted session
+	def resume(self):
+		self.file = open(self.path,"a")
+		
+	def frame(self,index,timestamp,path,offset,size):
+		
+		self.write({"frame":index,"time":timestamp,"file":path,"offset":offset,"size":size})
+		self.unsynced += 1
+		
+		if self.unsynced >= self.syncframes or time.monotonic() - self.lastsync >= self.syncseconds:
+			self.sync()
+			
+	#The frames were thinned down to count, every frame now stands for stride shots
+	def thinned(self,count,stride):
+		
+		self.write({"thinned":stride,"frames":count})
+		self.sync()
+		
+	def write(self,entry):
+		self.file.write(json.dumps(entry) + "\n")
+		
+	def sync(self):
+		
+		if self.onsync != None:
+			self.onsync()
+			
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.unsynced = 0
+		self.lastsync = time.monotonic()
+		
+	def close(self,frames):
+		
+		if self.file == None:
+			return
+		
+		self.write({"closed":time.time(),"frames":frames})
+		self.sync()
+		self.file.close()
+		self.file = None
+		
+class Session():
+	
+	def __init__(self,settings,started):
+		
+		self.settings = settings
+		self.started = started
+		self.frames = 0
+		self.last = None
+		self.closed = False
+		#Frames were thinned so far that each one stands for this many shots
+		self.stride = 1
+		
+#Read the journal in folder, None if there is none
+def load(folder):
+	
+	path = os.path.join(folder,"journal.jsonl")
+	if not os.path.exists(path):
+		return None
+	
+	session = None
+	
+	with open(path) as f:
+		for line in f:
+			
+			#A torn last line from a crash ends the journal
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				break
+			
+			if "settings" in entry:
+				session = Session(Settings.fromdict(entry["settings"]),entry["started"])
+			elif session == None:
+				break
+			elif "frame" in entry:
+				session.frames = entry["frame"] + 1
+				session.last = entry
+			elif "thinned" in entry:
+				session.frames = entry["frames"]
+				session.stride = entry["thinned"]
+				session.last = None
+			elif "closed" in entry:
+				session.closed = True
+				
+	#With regions, frames are journaled per region, count those of the first one
+	if session != None and len(session.settings.regions) > 0:
+		first = load(session.settings.regionsettings()[0].folder)
+		if first != None:
+			session.frames = first.frames
+			session.stride = first.stride
+			
+	return session
+
+#The journal in folder if its recording was interrupted, otherwise None
+def interrupted(folder):
+	
+	session = load(folder)
+	if session == None or session.closed:
+		return None
+	return session
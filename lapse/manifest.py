@@ -0,0 +1,76 @@
+#Frame manifests: ffmpeg concat demuxer lists naming every frame and how long it is shown.
+#Frames are read right where they are stored, loose files by name and frames in a frame
+#store through ffmpeg's subfile protocol, so nothing is renamed or copied. With the times
+#from the frame index, a manifest can keep the real spacing of the shots (variable frame
+#rate), and it can list any subset of the frames.
+#
+#Frames compacted into a chunk (see lapse.compact) are cut out of it, every frame of a chunk
+#is a keyframe and frame n is at n ms.
+#
+#Every recording leaves a frames.ffconcat in its folder, with the real capture spacing.
+
+import os
+
+#Seconds every frame is shown. "even" shows each frame for 1/fps. "real" keeps the gaps
+#between the capture times, scaled so the whole video is as long as it would be evenly,
+#or unscaled without an fps
+def durations(times,fps=None,timing="even"):
+	
+	if timing == "even" or len(times) < 2:
+		return [1.0 / (fps or 1.0)] * len(times)
+		
+	#A clock jump could make a gap negative, every frame is shown for at least 1ms
+	gaps = [max(0.001,b - a) for a,b in zip(times,times[1:])]
+	mean = sum(gaps) / len(gaps)
+	
+	scale = 1.0
+	if fps != None:
+		scale = 1.0 / fps / mean
+		
+	#The last frame has no next shot, it gets an average gap
+	return [gap * scale for gap in gaps] + [mean * scale]
+
+#Where ffmpeg finds a frame, given its lapse.index row and the recording folder
+def location(folder,row):
+	
+	if row["file"] != None and row["offset"] != None:
+		return os.path.abspath(os.path.join(folder,"chunks",os.path.basename(row["file"])))
+		
+	if row["file"] != None:
+		return os.path.abspath(os.path.join(folder,os.path.basename(row["file"])))
+		
+	start = row["offset"]
+	return "subfile,,start,{},end,{},,:{}".format(start,start + row["size"],os.path.abspath(os.path.join(folder,"frames.dat")))
+
+#A file line of a concat list, quotes in the path escaped the way the concat demuxer reads them
+def fileline(path):
+	return "file '" + path.replace("'","'\\''") + "'\n"
+
+#Concat list lines for a frame
+def entry(folder,row):
+	
+	text = fileline(location(folder,row))
+	if row["file"] != None and row["offset"] != None:
+		text += "inpoint {:.3f}\noutpoint {:.3f}\n".format(row["offset"] / 1000,(row["offset"] + 1) / 1000)
+	else:
+		#Images are read at 25 fps otherwise, which rounds every start time to 40ms, and
+		#vfr then drops frames that land on the same tick
+		text += "option framerate 1000\n"
+	return text
+
+#Write a concat list of the frames in rows (lapse.index rows of the recording in folder)
+def write(path,folder,rows,seconds):
+	
+	with open(path,"w") as f:
+		f.write("ffconcat version 1.0\n")
+		for row,duration in zip(rows,seconds):
+			f.write(entry(folder,row))
+			f.write("duration {:.6f}\n".format(duration))
+
+#ffmpeg input options for reading the manifest written for a recording
+def inputoptions(settings,path):
+	
+	options = ["-f","concat","-safe","0"]
+	if settings.storage == "container":
+		options += ["-protocol_whitelist","file,subfile"]
+	return options + ["-i",path]
@@ -0,0 +1,158 @@
+#Per stage timings of the capture pipeline. Every shot goes through
+#	grab    taking the screenshot
+#	convert cropping/scaling it per region and turning it into bytes for the encoders
+#	queue   waiting for a writer (blocked in put() and sitting in the queue)
+#	encode  the frame codec, in a writer process
+#	write   putting the encoded frame on disk (or into ffmpeg, when streaming)
+#Metrics keeps the last few hundred timings of each for percentiles, MetricsLog writes one
+#line per frame, and MetricsServer serves everything in the Prometheus text format.
+
+import collections
+import threading
+import http.server
+import json
+import csv
+import os
+
+stages = ["grab","convert","queue","encode","write"]
+
+def percentiles(values):
+	
+	if len(values) == 0:
+		return {}
+		
+	values = sorted(values)
+	pick = lambda p: values[min(len(values) - 1,int(p / 100.0 * len(values)))]
+	
+	return {
+		"p50":pick(50) * 1000,
+		"p90":pick(90) * 1000,
+		"p99":pick(99) * 1000,
+		"max":values[-1] * 1000,
+	}
+
+class Metrics():
+	
+	def __init__(self,window=300):
+		
+		#Stages are added from the capture worker and every writer pool's feeder thread
+		self.lock = threading.Lock()
+		self.recent = {stage:collections.deque(maxlen=window) for stage in stages}
+		self.count = {stage:0 for stage in stages}
+		self.seconds = {stage:0.0 for stage in stages}
+		self.bytes = {stage:0 for stage in stages}
+		self.frames = 0
+		self.held = 0
+		self.missed = 0
+		
+	def add(self,stage,seconds,size=0):
+		
+		with self.lock:
+			self.recent[stage].append(seconds)
+			self.count[stage] += 1
+			self.seconds[stage] += seconds
+			self.bytes[stage] += size
+			
+	#Percentiles in ms of the recent timings of every stage that has any
+	def summary(self):
+		
+		with self.lock:
+			recent = {stage:list(values) for stage,values in self.recent.items()}
+			
+		return {stage:percentiles(values) for stage,values in recent.items() if len(values) > 0}
+		
+	def prometheus(self):
+		
+		summary = self.summary()
+		
+		with self.lock:
+			lines = [
+				"# HELP screenlapse_stage_seconds Time spent per frame in each pipeline stage, over the last frames",
+				"# TYPE screenlapse_stage_seconds summary",
+			]
+			for stage in stages:
+				for name,quantile in (("p50","0.5"),("p90","0.9"),("p99","0.99")):
+					if name in summary.get(stage,{}):
+						lines.append('screenlapse_stage_seconds{stage="%s",quantile="%s"} %g' % (stage,quantile,summary[stage][name] / 1000))
+				lines.append('screenlapse_stage_seconds_sum{stage="%s"} %g' % (stage,self.seconds[stage]))
+				lines.append('screenlapse_stage_seconds_count{stage="%s"} %d' % (stage,self.count[stage]))
+				
+			lines += ["# HELP screenlapse_stage_bytes_total Bytes handled by each pipeline stage","# TYPE screenlapse_stage_bytes_total counter"]
+			for stage in stages:
+				lines.append('screenlapse_stage_bytes_total{stage="%s"} %d' % (stage,self.bytes[stage]))
+				
+			for name,value in (("frames",self.frames),("held",self.held),("missed",self.missed)):
+				lines += ["# TYPE screenlapse_%s_total counter" % name,"screenlapse_%s_total %d" % (name,value)]
+				
+		return "\n".join(lines) + "\n"
+
+#One line per stored frame, as CSV or JSON lines depending on the extension of path.
+#Appends, so a resumed recording carries on in the same log
+class MetricsLog():
+	
+	fields = ["time","region","frame","lateness_ms","grab_ms","convert_ms","queue_ms","encode_ms","write_ms","grab_bytes","frame_bytes"]
+	
+	def __init__(self,path):
+		
+		self.path = path
+		self.lock = threading.Lock()
+		self.json = os.path.splitext(path)[1].lower() in (".jsonl",".json")
+		
+		existed = os.path.exists(path) and os.path.getsize(path) > 0
+		self.file = open(path,"a",newline="")
+		self.writer = None
+		if not self.json:
+			self.writer = csv.DictWriter(self.file,self.fields,extrasaction="ignore")
+			if not existed:
+				self.writer.writeheader()
+				
+	def write(self,row):
+		
+		with self.lock:
+			if self.file == None:
+				return
+			if self.json:
+				self.file.write(json.dumps(row) + "\n")
+			else:
+				self.writer.writerow(row)
+				
+	def close(self):
+		
+		with self.lock:
+			if self.file != None:
+				self.file.close()
+				self.file = None
+
+#Serves metrics on http://127.0.0.1:port/metrics from a thread of its own
+class MetricsServer():
+	
+	def __init__(self,metrics,port,host="127.0.0.1"):
+		
+		class Handler(http.server.BaseHTTPRequestHandler):
+			
+			def do_GET(self):
+				
+				if self.path.split("?")[0] != "/metrics":
+					self.send_error(404)
+					return
+					
+				body = metrics.prometheus().encode()
+				self.send_response(200)
+				self.send_header("Content-Type","text/plain; version=0.0.4")
+				self.send_header("Content-Length",str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+				
+			#Scrapes every few seconds would flood the log otherwise
+			def log_message(self,*args):
+				pass
+				
+		self.server = http.server.ThreadingHTTPServer((host,port),Handler)
+		self.server.daemon_threads = True
+		self.thread = threading.Thread(target=self.server.serve_forever,daemon=True)
+		self.thread.start()
+		
+	def close(self):
+		
+		self.server.shutdown()
+		self.server.server_close()
@@ -0,0 +1,87 @@
+#Shot timing against absolute monotonic deadlines. Shot n is due at start + n * interval,
+#no matter how long the previous shots took, so capture time never adds up into drift.
+#When capture overruns one or more deadlines, the overdue shots are coalesced into a
+#single shot and counted as missed.
+
+import time
+
+class DeadlineScheduler():
+	
+	def __init__(self,interval,clock=time.monotonic):
+		
+		self.interval = interval
+		self.clock = clock
+		
+		self.start = None
+		self.base = None
+		self.shot = 0
+		
+		#Bookkeeping, shown in the ui and logs
+		self.taken = 0
+		self.missed = 0
+		self.lateness = 0.0
+		self.lateness_total = 0.0
+		self.lateness_max = 0.0
+		
+	def begin(self):
+		
+		self.start = self.clock()
+		self.base = self.start
+		self.shot = 0
+		
+	def deadline(self):
+		return self.base + self.shot * self.interval
+	
+	#Seconds left until the next shot is due, 0 if it is already due
+	def timeuntil(self):
+		return max(0.0, self.deadline() - self.clock())
+	
+	#Seconds since begin()
+	def elapsed(self):
+		return self.clock() - self.start
+	
+	#Claim the current slot for a shot, returns its lateness in seconds
+	def take(self):
+		
+		now = self.clock()
+		
+		#Latest slot that is due by now, skipping everything that was overrun
+		slot = max(self.shot, int((now - self.base) / self.interval))
+		self.missed += slot - self.shot
+		
+		lateness = max(0.0, now - (self.base + slot * self.interval))
+		self.shot = slot + 1
+		
+		self.taken += 1
+		self.lateness = lateness
+		self.lateness_total += lateness
+		self.lateness_max = max(self.lateness_max, lateness)
+		
+		return lateness
+	
+	#Change the interval from the next shot on, without moving any past deadline
+	def setinterval(self,interval):
+		
+		if self.shot == 0:
+			self.interval = interval
+			return
+		
+		self.base = self.deadline() - self.interval
+		self.shot = 1
+		self.interval = interval
+		
+	def lateness_mean(self):
+		
+		if self.taken == 0:
+			return 0.0
+		return self.lateness_total / self.taken
+	
+	def stats(self):
+		
+		return {
+			"elapsed":self.elapsed(),
+			"missed":self.missed,
+			"lateness":self.lateness,
+			"lateness_mean":self.lateness_mean(),
+			"lateness_max":self.lateness_max,
+		}
@@ -0,0 +1,110 @@
+#Segmented encoding. While recording continues, every closed run of frames is encoded
+#into its own video segment in the background. Exporting then only has to stream copy
+#the segments together, which takes about as long for 100 frames as for 100000.
+
+import threading
+import queue
+import glob
+import os
+
+from lapse import store
+from lapse import ffmpeg
+from lapse import manifest
+
+class SegmentEncoder(threading.Thread):
+	
+	def __init__(self,settings):
+		
+		threading.Thread.__init__(self,daemon=True)
+		
+		self.settings = settings
+		self.folder = os.path.join(settings.folder,"segments")
+		
+		self.pending = queue.Queue()
+		self.closed = 0
+		self.segments = 0
+		self.error = None
+		
+	def start(self):
+		
+		os.makedirs(self.folder,exist_ok=True)
+		threading.Thread.start(self)
+		
+	#Called by the capture worker with the number of frames written so far
+	def frameadded(self,count):
+		
+		while count - self.closed >= self.settings.segment_frames:
+			self.pending.put((self.closed,self.settings.segment_frames))
+			self.closed += self.settings.segment_frames
+			
+	#Encode the last, partial segment and wait for everything to finish
+	def close(self,count):
+		
+		if count > self.closed:
+			self.pending.put((self.closed,count - self.closed))
+			self.closed = count
+			
+		self.pending.put(None)
+		self.join()
+		
+		if self.error != None:
+			raise self.error
+		
+	def run(self):
+		
+		while True:
+			segment = self.pending.get()
+			if segment == None:
+				return
+			
+			#Keep draining after a failure, so close() still returns
+			if self.error != None:
+				continue
+			
+			try:
+				self.encode(*segment)
+			except Exception as e:
+				self.error = e
+				
+	def encode(self,start,count):
+		
+		output = os.path.join(self.folder,"seg_{:05d}.mp4".format(self.segments))
+		
+		if self.settings.storage == "container":
+			store.export(self.settings.folder,self.settings.framecodec(),self.settings.fps,output,start,start + count)
+			self.segments += 1
+			return
+		
+		command = [
+			"ffmpeg","-y","-loglevel","error",
+			"-framerate",str(self.settings.fps),
+			"-start_number",str(start),
+			"-i",self.settings.framepattern(),
+			"-frames:v",str(count),
+			output
+		]
+		
+		ffmpeg.run(command)
+		
+		self.segments += 1
+		
+#Join all segments of a recording into one video, without re-encoding
+def concat_segments(folder,output,job=None):
+	
+	segments = sorted(glob.glob(os.path.join(folder,"segments","seg_*.mp4")))
+	if len(segments) == 0:
+		raise RuntimeError("No segments were recorded")
+	
+	concat(segments,os.path.join(folder,"segments","list.txt"),output,job)
+	
+#Stream copy videos encoded with the same settings into one, through a concat demuxer listing.
+#Whether the copied frames count as done for job depends on whether encoding them already did
+def concat(videos,listing,output,job=None,counted=True):
+	
+	with open(listing,"w") as f:
+		for video in videos:
+			f.write(manifest.fileline(os.path.abspath(video)))
+			
+	command = ["ffmpeg","-y","-loglevel","error","-f","concat","-safe","0","-i",listing,"-c","copy",output]
+	
+	ffmpeg.run(command,job=job,counted=counted)
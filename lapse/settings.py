@@ -0,0 +1,266 @@
+#Recording settings, shared between the ui and the capture worker.
+#The worker gets its own copy at start, so the ui can't change them mid recording
+
+import re
+import os
+
+from lapse import codec
+
+class Settings():
+	
+	def __init__(self):
+		
+		self.offset = (0,0)
+		self.size = (1920,1080)
+		#Size frames are scaled to right after grabbing, None keeps the capture size
+		self.output_size = None
+		
+		#Named regions recorded from the same grab, each into its own folder and video.
+		#Empty records offset/size as the only region. See parseregions
+		self.regions = []
+		#Name of the region these settings record, None for the whole recording
+		self.name = None
+		self.spm = 6.0
+		self.fps = 2.0
+		
+		#Frame storage codec spec, see lapse.codec
+		self.codec = "png"
+		#"files" saves one image file per frame, "container" appends all frames
+		#into a single lapse.store frame store
+		self.storage = "files"
+		
+		#Encoder processes writing frames, how many grabbed frames may wait for them,
+		#and what to do when that queue is full (see lapse.writer)
+		self.writers = 2
+		self.queue_depth = 8
+		self.backpressure = "block"
+		
+		#Capture backend name from lapse.capture, or "auto" to use the fastest one
+		self.backend = "auto"
+		
+		#"frames" saves every shot into the folder for exporting later,
+		#"stream" pipes shots straight into ffmpeg while recording,
+		#"segments" saves shots and encodes them in chunks while recording
+		self.mode = "frames"
+		self.segment_frames = 300
+		
+		#ffmpeg encoders exporting parts of the video at once, 1 exports in a single pass
+		self.export_workers = 1
+		#"even" shows every exported frame equally long, "real" keeps the spacing they were
+		#captured with (see lapse.manifest)
+		self.export_timing = "even"
+		#Only export the frames lapse.index.select picks with these arguments, empty exports all
+		self.export_select = {}
+		#Keep an all intra encode of the frames, so exports that only change the FPS or
+		#frame range are cut from it instead of encoded again (see lapse.export)
+		self.export_cache = False
+		#Videos to export all at once from a single decode of the frames, instead of video.
+		#See parserenditions
+		self.renditions = []
+		
+		#Move the shot rate between spm_min and spm_max with how busy the screen is,
+		#instead of keeping it at spm
+		self.adaptive = False
+		self.spm_min = 2.0
+		self.spm_max = 30.0
+		
+		#Shots where less than this fraction of the screen changed are skipped as holds,
+		#0 keeps every shot. Boxes in change_mask are ignored when comparing
+		self.change_threshold = 0.0
+		self.change_mask = []
+		
+		#Disk space for the recorded frames in MB, 0 for no limit. Once it's used up, every
+		#other frame is thrown away and the shot rate halves (see CaptureWorker.thin)
+		self.quota_mb = 0
+		
+		#Keep a lapse.index frame index (times, hashes, change scores) of the stored frames
+		self.frame_index = True
+		
+		#Fold every compact_frames stored frame files into a lossless video chunk while
+		#recording, see lapse.compact
+		self.compact = False
+		self.compact_frames = 600
+		
+		#Per frame stage timings are logged to this file in the folder, as CSV, or as
+		#JSON lines if it ends in .jsonl. Empty logs nothing. metrics_port serves them to
+		#Prometheus on localhost, None doesn't
+		self.metrics_log = "metrics.csv"
+		self.metrics_port = None
+		
+		#Temp output
+		self.folder = "output"
+		self.video = "video.mp4"
+		
+	def bbox(self):
+		
+		ox,oy = self.offset
+		sx,sy = self.size
+		return (ox, oy, ox + sx, oy + sy)
+	
+	#One Settings per recorded region, each with its own folder and video
+	def regionsettings(self):
+		
+		if len(self.regions) == 0:
+			return [self]
+		
+		result = []
+		base,extension = os.path.splitext(self.video)
+		
+		for region in self.regions:
+			settings = Settings.fromdict(self.todict())
+			settings.regions = []
+			settings.name = region["name"]
+			settings.offset = tuple(region["offset"])
+			settings.size = tuple(region["size"])
+			settings.output_size = None
+			if region.get("output_size") != None:
+				settings.output_size = tuple(region["output_size"])
+			settings.folder = os.path.join(self.folder,region["name"])
+			settings.video = base + "_" + region["name"] + extension
+			settings.renditions = [dict(rendition,output=renditionpath(rendition["output"],region["name"])) for rendition in self.renditions]
+			result.append(settings)
+			
+		return result
+	
+	#The box around every recorded region, grabbed once per shot
+	def capturebox(self):
+		
+		boxes = [settings.bbox() for settings in self.regionsettings()]
+		return (
+			min(box[0] for box in boxes),
+			min(box[1] for box in boxes),
+			max(box[2] for box in boxes),
+			max(box[3] for box in boxes),
+		)
+	
+	#Size of the stored and exported frames
+	def framesize(self):
+		
+		if self.output_size == None:
+			return self.size
+		return self.output_size
+	
+	def framecodec(self):
+		return codec.parse(self.codec)
+	
+	def framepath(self,index):
+		return self.folder + "/img_" + "{:06d}".format(index) + "." + self.framecodec().extension
+	
+	#Input pattern for ffmpeg, matching framepath
+	def framepattern(self):
+		return self.folder + "/img_%06d." + self.framecodec().extension
+	
+	#Seconds between two shots
+	def interval(self):
+		
+		return 60.0 / self.spm
+	
+	def todict(self):
+		return dict(vars(self))
+	
+	@classmethod
+	def fromdict(cls,values):
+		
+		settings = cls()
+		for name,value in values.items():
+			if name in ("offset","size","output_size") and value != None:
+				value = tuple(value)
+			setattr(settings,name,value)
+		return settings
+
+#Parse regions written as "name:x,y,WxH" or "name:x,y,WxH>WxH" (scaled to the second
+#size), separated by ";". For example "left:0,0,1920x1080;both:0,0,3840x1080>1920x540"
+def parseregions(text):
+	
+	regions = []
+	
+	for part in text.split(";"):
+		
+		part = part.strip()
+		if part == "":
+			continue
+		
+		try:
+			name,box = part.split(":")
+			box,ignored,output = box.partition(">")
+			x,y,size = box.split(",")
+			width,height = size.lower().split("x")
+			
+			region = {"name":name.strip(),"offset":(int(x),int(y)),"size":(int(width),int(height)),"output_size":None}
+			if output != "":
+				width,height = output.lower().split("x")
+				region["output_size"] = (int(width),int(height))
+		except ValueError:
+			raise ValueError("Can't read region \"" + part + "\", expected name:x,y,WxH")
+		
+		if region["name"] in [other["name"] for other in regions]:
+			raise ValueError("Region " + region["name"] + " is listed twice")
+		
+		regions.append(region)
+		
+	return regions
+
+#Parse change mask boxes written as "x,y,WxH", separated by ";", into (x0,y0,x1,y1) boxes
+def parsemask(text):
+	
+	mask = []
+	
+	for part in text.split(";"):
+		
+		part = part.strip()
+		if part == "":
+			continue
+		
+		try:
+			x,y,size = part.split(",")
+			width,height = size.lower().split("x")
+			mask.append((int(x),int(y),int(x) + int(width),int(y) + int(height)))
+		except ValueError:
+			raise ValueError("Can't read change mask box \"" + part + "\", expected x,y,WxH")
+			
+	return mask
+
+#A rendition's file for one region
+def renditionpath(path,name):
+	
+	base,extension = os.path.splitext(path)
+	return base + "_" + name + extension
+
+#Parse renditions written as "file:WxH" plus any of ",codec", ",bitrate" (like 4M or 800k),
+#",Nfps" and ",Ns" (only the first N seconds), separated by ";". A width alone keeps the
+#aspect ratio. For example "video_720.mp4:1280x720,4M;teaser.gif:480,10fps,5s"
+def parserenditions(text):
+	
+	renditions = []
+	
+	for part in text.split(";"):
+		
+		part = part.strip()
+		if part == "":
+			continue
+		
+		try:
+			output,ignored,options = part.rpartition(":")
+			options = [option.strip() for option in options.split(",")]
+			
+			width,ignored,height = options[0].lower().partition("x")
+			rendition = {"output":output.strip(),"size":(int(width),int(height or -2)),"codec":None,"bitrate":None,"fps":None,"seconds":None}
+			
+			for option in options[1:]:
+				if re.fullmatch(r"[0-9.]+[kKmM]",option):
+					rendition["bitrate"] = option
+				elif re.fullmatch(r"[0-9.]+fps",option):
+					rendition["fps"] = float(option[:-3])
+				elif re.fullmatch(r"[0-9.]+s",option):
+					rendition["seconds"] = float(option[:-1])
+				elif option != "":
+					rendition["codec"] = option
+		except ValueError:
+			raise ValueError("Can't read rendition \"" + part + "\", expected file:WxH[,codec][,bitrate][,Nfps][,Ns]")
+		
+		if rendition["output"] == "":
+			raise ValueError("Rendition \"" + part + "\" has no file")
+		
+		renditions.append(rendition)
+		
+	return renditions
@@ -0,0 +1,215 @@
+#Single file frame store. Encoded frames are appended to frames.dat, and every frame
+#gets a fixed size record (offset, length, capture timestamp) in frames.idx. Readers
+#mmap both files, so getting at frame n never scans anything, and exporting streams
+#the encoded frames straight out of the mapping into ffmpeg.
+#
+#The index record is written after the frame data, so after a crash the index never
+#points past the end of the data.
+#
+#Thinning rewrites the store into frames.dat.thin and frames.idx.thin, and then moves
+#the data and then the index into place. Opening a store finishes a move a crash cut short.
+
+import struct
+import mmap
+import os
+
+from lapse import ffmpeg
+
+record = struct.Struct("<QId")
+
+class FrameStore():
+	
+	def __init__(self,folder):
+		
+		self.folder = folder
+		self.datapath = os.path.join(folder,"frames.dat")
+		self.indexpath = os.path.join(folder,"frames.idx")
+		
+		recover(folder)
+		
+		self.data = open(self.datapath,"ab")
+		self.index = open(self.indexpath,"ab")
+		
+		self.offset = self.data.tell()
+		self.count = self.index.tell() // record.size
+		
+	#Append one encoded frame, returns (frame index,offset)
+	def append(self,data,timestamp):
+		
+		offset = self.offset
+		self.data.write(data)
+		self.index.write(record.pack(offset,len(data),timestamp))
+		
+		self.offset += len(data)
+		self.count += 1
+		return self.count - 1,offset
+	
+	#Throw away every frame from index count on, for resuming from a journal
+	def truncate(self,count):
+		
+		if count >= self.count:
+			return
+		
+		#Buffered frames have to reach the index file before it is read
+		self.flush()
+		
+		end = 0
+		if count > 0:
+			with open(self.indexpath,"rb") as f:
+				f.seek((count - 1) * record.size)
+				offset,length,timestamp = record.unpack(f.read(record.size))
+				end = offset + length
+				
+		self.data.truncate(end)
+		self.index.truncate(count * record.size)
+		
+		self.offset = end
+		self.count = count
+		
+	#Keep only every other frame (0, 2, 4...), returns how many are left
+	def thin(self):
+		
+		self.sync()
+		reader = FrameReader(self.folder)
+		
+		try:
+			with open(self.datapath + ".thin","wb") as data, open(self.indexpath + ".thin","wb") as index:
+				offset = 0
+				for i in range(0,len(reader),2):
+					frame = reader.frame(i)
+					data.write(frame)
+					index.write(record.pack(offset,len(frame),reader.timestamp(i)))
+					offset += len(frame)
+					frame.release()
+					
+				data.flush()
+				os.fsync(data.fileno())
+				index.flush()
+				os.fsync(index.fileno())
+		finally:
+			reader.close()
+			
+		self.close()
+		os.replace(self.datapath + ".thin",self.datapath)
+		os.replace(self.indexpath + ".thin",self.indexpath)
+		
+		self.data = open(self.datapath,"ab")
+		self.index = open(self.indexpath,"ab")
+		self.offset = self.data.tell()
+		self.count = self.index.tell() // record.size
+		return self.count
+	
+	def flush(self):
+		
+		self.data.flush()
+		self.index.flush()
+		
+	#Flush all the way to disk, data before index
+	def sync(self):
+		
+		self.data.flush()
+		os.fsync(self.data.fileno())
+		self.index.flush()
+		os.fsync(self.index.fileno())
+		
+	def close(self):
+		
+		self.data.close()
+		self.index.close()
+		
+class FrameReader():
+	
+	def __init__(self,folder):
+		
+		self.data = None
+		self.index = None
+		self.count = 0
+		
+		datapath = os.path.join(folder,"frames.dat")
+		indexpath = os.path.join(folder,"frames.idx")
+		
+		recover(folder)
+		
+		#Empty files can't be mapped, they just have no frames
+		if os.path.getsize(datapath) == 0 or os.path.getsize(indexpath) < record.size:
+			return
+		
+		with open(datapath,"rb") as f:
+			self.data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+		with open(indexpath,"rb") as f:
+			self.index = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+			
+		self.count = len(self.index) // record.size
+		
+		#Drop index records whose frame didn't make it into the data file
+		while self.count > 0 and sum(self.entry(self.count - 1)[:2]) > len(self.data):
+			self.count -= 1
+			
+	def __len__(self):
+		return self.count
+	
+	#(offset,length,timestamp) of frame i
+	def entry(self,i):
+		return record.unpack_from(self.index,i * record.size)
+	
+	#Encoded bytes of frame i, as a view into the mapping
+	def frame(self,i):
+		
+		offset,length,timestamp = self.entry(i)
+		return memoryview(self.data)[offset:offset + length]
+	
+	def timestamp(self,i):
+		return self.entry(i)[2]
+	
+	#Write frames [start,stop) into a file like object, without copying them out first
+	def writeframes(self,out,start=0,stop=None):
+		
+		if stop == None:
+			stop = self.count
+			
+		for i in range(start,stop):
+			view = self.frame(i)
+			while len(view) > 0:
+				written = out.write(view)
+				view = view[written:]
+				
+	def close(self):
+		
+		if self.data != None:
+			self.data.close()
+			self.index.close()
+			self.data = None
+			self.index = None
+			
+#Finish or undo a thinning that was cut short. With both .thin files left, the rewrite
+#may not be complete, so the old store stays. With only the index left, the data was
+#already moved, so the index has to follow
+def recover(folder):
+	
+	datapath = os.path.join(folder,"frames.dat")
+	indexpath = os.path.join(folder,"frames.idx")
+	
+	if os.path.exists(datapath + ".thin"):
+		os.remove(datapath + ".thin")
+		if os.path.exists(indexpath + ".thin"):
+			os.remove(indexpath + ".thin")
+	elif os.path.exists(indexpath + ".thin"):
+		os.replace(indexpath + ".thin",indexpath)
+		
+#Encode frames [start,stop) of a store into a video, piping them into ffmpeg.
+#job follows its progress, see lapse.ffmpeg.run
+def export(folder,framecodec,fps,output,start=0,stop=None,extra=None,job=None):
+	
+	reader = FrameReader(folder)
+	
+	try:
+		if len(reader) == 0:
+			raise RuntimeError("No frames were recorded")
+		
+		command = ["ffmpeg","-y","-loglevel","error","-f",framecodec.pipe,"-framerate",str(fps),"-i","-"]
+		command += extra or []
+		command.append(output)
+		
+		ffmpeg.run(command,lambda stdin: reader.writeframes(stdin,start,stop),job)
+	finally:
+		reader.close()
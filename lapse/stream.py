@@ -0,0 +1,63 @@
+#Streaming encode: a long lived ffmpeg process started with the recording, fed raw
+#frames over stdin as they are grabbed. Stopping the recording only has to close the
+#pipe and wait for ffmpeg to flush, instead of encoding the whole session at export.
+
+import subprocess
+
+class FFmpegStream():
+	
+	def __init__(self,output,size,fps,pixfmt="rgb24"):
+		
+		self.output = output
+		self.size = size
+		self.fps = fps
+		self.pixfmt = pixfmt
+		self.process = None
+		
+	def open(self):
+		
+		command = [
+			"ffmpeg","-y","-loglevel","error",
+			"-f","rawvideo","-pix_fmt",self.pixfmt,
+			"-s","{}x{}".format(self.size[0],self.size[1]),
+			"-framerate",str(self.fps),
+			"-i","-",
+			self.output
+		]
+		
+		#Unbuffered, so frame bytes go straight from our buffer into the pipe
+		self.process = subprocess.Popen(command,stdin=subprocess.PIPE,stderr=subprocess.PIPE,bufsize=0)
+		
+	#Write one frame. Takes a PIL image or anything exposing the buffer protocol
+	def write(self,frame):
+		
+		if hasattr(frame,"tobytes"):
+			if frame.mode != "RGB":
+				frame = frame.convert("RGB")
+			frame = frame.tobytes()
+			
+		#Raw pipe writes may be partial, slicing a memoryview doesn't copy
+		view = memoryview(frame)
+		try:
+			while len(view) > 0:
+				written = self.process.stdin.write(view)
+				view = view[written:]
+		except BrokenPipeError:
+			self.close()
+			
+	def close(self):
+		
+		if self.process == None:
+			return
+		
+		process = self.process
+		self.process = None
+		
+		try:
+			process.stdin.close()
+		except BrokenPipeError:
+			pass
+		
+		error = process.stderr.read().decode(errors="replace").strip()
+		if process.wait() != 0:
+			raise RuntimeError("ffmpeg exited with " + str(process.returncode) + ": " + error)
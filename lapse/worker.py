@@ -0,0 +1,602 @@
+#The capture worker owns the whole grab -> encode -> write pipeline, so the tk
+#mainloop only ever sends commands and reads progress back.
+#
+#Every shot is one grab of the box around all recorded regions. Each region then has a
+#Track, with its own crop, change detection, frame store, journal and encoders.
+
+import threading
+import queue
+import shutil
+import time
+import logging
+import os
+
+from lapse import capture
+from lapse.schedule import DeadlineScheduler
+from lapse.stream import FFmpegStream
+from lapse.segment import SegmentEncoder
+from lapse.writer import WriterPool
+from lapse.store import FrameStore, FrameReader
+from lapse.journal import Journal
+from lapse.index import FrameIndex
+from lapse.compact import Compactor
+from lapse import journal
+from lapse import manifest
+from lapse.metrics import Metrics, MetricsLog, MetricsServer
+
+log = logging.getLogger("screenlapse")
+
+class CaptureWorker(threading.Thread):
+	
+	#Pass the lapse.journal.Session of an interrupted recording as resume to continue it.
+	#preview is the (width,height) to fit preview thumbnails of the grab into, None sends none
+	def __init__(self,settings,resume=None,preview=None,previewrate=2.0):
+		
+		threading.Thread.__init__(self,daemon=True)
+		
+		self.settings = settings
+		self.resume = resume
+		
+		#ui -> worker
+		self.commands = queue.Queue()
+		#worker -> ui, as (kind,info) tuples
+		self.progress = queue.Queue()
+		
+		self.scheduler = DeadlineScheduler(settings.interval())
+		self.bbox = settings.capturebox()
+		self.tracks = [Track(self,regionsettings,self.bbox) for regionsettings in settings.regionsettings()]
+		self.adaptive = None
+		self.activity = None
+		self.backend = None
+		self.journal = None
+		
+		#Over quota bytes, every other stored frame is thinned out. Each stored frame then
+		#stands for stride shots
+		self.quota = settings.quota_mb * 1024 * 1024
+		self.stride = 1
+		
+		self.metrics = Metrics()
+		self.metricslog = None
+		self.metricsserver = None
+		
+		self.preview = preview
+		self.previewrate = previewrate
+		self.previewed = None
+		
+	#Frames recorded so far, of the first region
+	@property
+	def record_frame(self):
+		return self.tracks[0].record_frame
+	
+	def stop(self):
+		self.commands.put("stop")
+		
+	def run(self):
+		
+		try:
+			self.prepare()
+			self.loop()
+		except Exception as e:
+			log.exception("Capture failed")
+			self.progress.put(("error",{"message":str(e)}))
+		
+		try:
+			self.finish()
+		except Exception as e:
+			log.exception("Finishing capture failed")
+			self.progress.put(("error",{"message":str(e)}))
+		
+		if self.scheduler.start != None:
+			stats = self.scheduler.stats()
+			for track in self.tracks:
+				log.info("Recorded %d frames%s in %.1fs, %d held, %d missed shots, lateness mean %.1fms max %.1fms",
+					track.record_frame, track.label(), stats["elapsed"], track.held, stats["missed"],
+					stats["lateness_mean"] * 1000, stats["lateness_max"] * 1000)
+		
+		self.progress.put(("stopped",{"frames":self.record_frame}))
+		
+	def prepare(self):
+		
+		if self.quota > 0 and self.settings.mode != "frames":
+			raise RuntimeError("A disk quota only works in Frames mode")
+			
+		if self.settings.compact:
+			if self.settings.mode != "frames" or self.settings.storage != "files" or not self.settings.frame_index:
+				raise RuntimeError("Compaction only works in Frames mode, with Files storage and the frame index")
+			if self.quota > 0:
+				raise RuntimeError("Compaction and a disk quota can't be used together")
+		
+		if self.resume != None:
+			log.info("Resuming recording")
+		else:
+			#Clear existing folder
+			shutil.rmtree(self.settings.folder,ignore_errors=True)
+		os.makedirs(self.settings.folder,exist_ok=True)
+		
+		if self.settings.metrics_log:
+			self.metricslog = MetricsLog(os.path.join(self.settings.folder,self.settings.metrics_log))
+			
+		#Metrics are nice to have, a port already in use shouldn't stop the recording
+		if self.settings.metrics_port != None:
+			try:
+				self.metricsserver = MetricsServer(self.metrics,self.settings.metrics_port)
+				log.info("Serving metrics on http://127.0.0.1:%d/metrics", self.settings.metrics_port)
+			except OSError as e:
+				log.warning("Can't serve metrics on port %d: %s", self.settings.metrics_port, e)
+				
+		self.backend,timings = capture.select(self.settings.backend,self.bbox)
+		for name,seconds in timings.items():
+			log.info("Capture backend %s: %.1fms per grab", name, seconds * 1000)
+		self.progress.put(("backend",{"name":self.backend.name,"timings":timings}))
+		
+		if self.settings.adaptive:
+			#Imported here, so numpy is only loaded when change detection is used
+			from lapse.change import ChangeDetector
+			from lapse.adaptive import AdaptiveRate
+			#Threshold 0 keeps every frame, so it scores each shot against the one before
+			self.activity = ChangeDetector(0.0,mask=self.settings.change_mask)
+			self.adaptive = AdaptiveRate(60.0 / self.settings.spm_max,60.0 / self.settings.spm_min)
+			#Start inside the bounds, spm may be outside of them
+			self.scheduler.setinterval(self.adaptive.clamp(self.scheduler.interval))
+			
+		#With several regions, every region journals into its own folder, and this
+		#journal only marks whether the session as a whole was closed
+		if len(self.settings.regions) > 0 and self.settings.mode != "stream":
+			self.journal = Journal(self.settings.folder)
+			if self.resume != None:
+				self.journal.resume()
+			else:
+				self.journal.create(self.settings)
+				
+		for track in self.tracks:
+			track.prepare(self.resume != None)
+			
+		#A thinned recording carries on at the rate its frames are thinned to
+		if self.resume != None and self.resume.stride > 1:
+			self.stride = self.resume.stride
+			self.scheduler.setinterval(self.scheduler.interval * self.stride)
+			
+	def finish(self):
+		
+		if self.backend != None:
+			self.backend.close()
+			
+		error = None
+		for track in self.tracks:
+			try:
+				track.finish()
+			except Exception as e:
+				log.exception("Finishing %s failed", track.settings.name or "recording")
+				error = error or e
+				
+		if self.journal != None:
+			self.journal.close(self.record_frame)
+			
+		if self.metricslog != None:
+			self.metricslog.close()
+			
+		if self.metricsserver != None:
+			self.metricsserver.close()
+			
+		if error != None:
+			raise error
+		
+	def loop(self):
+		
+		self.scheduler.begin()
+		
+		while True:
+			
+			#Sleep until the next deadline, waking up early on a stop command
+			try:
+				command = self.commands.get(timeout=self.scheduler.timeuntil())
+			except queue.Empty:
+				command = None
+				
+			if command == "stop":
+				return
+			
+			missed = self.scheduler.missed
+			self.scheduler.take()
+			
+			if self.scheduler.missed != missed:
+				log.warning("Capture overran, skipped %d shots", self.scheduler.missed - missed)
+				self.metrics.missed = self.scheduler.missed
+			
+			self.saveframe()
+			
+			if self.quota > 0 and self.diskusage() > self.quota and self.record_frame > 1:
+				self.thin()
+				
+	def saveframe(self):
+		
+		start = time.perf_counter()
+		grab = self.backend.grab(self.bbox)
+		grabtime = time.perf_counter() - start
+		
+		info = self.scheduler.stats()
+		info["time"] = time.time()
+		info["grab"] = grabtime
+		info["grab_bytes"] = grab.width * grab.height * len(grab.getbands())
+		self.metrics.add("grab",grabtime,info["grab_bytes"])
+		
+		frames = []
+		converts = []
+		for track in self.tracks:
+			start = time.perf_counter()
+			frames.append(track.cut(grab))
+			converts.append(time.perf_counter() - start)
+		
+		#The first region sets the pace
+		thumbnail = None
+		if self.activity != None:
+			thumbnail = self.activity.thumbnail(frames[0])
+			ignored,score = self.activity.check(frames[0],thumbnail)
+			self.adapt(score)
+			
+		info["spm"] = 60.0 / self.scheduler.interval
+		
+		for i in range(len(self.tracks)):
+			trackinfo = dict(info)
+			trackinfo["convert"] = converts[i]
+			self.tracks[i].saveframe(frames[i],trackinfo,thumbnail if i == 0 else None)
+			
+		self.sendpreview(grab)
+		
+	#Hand the ui a small copy of the grab, at most previewrate times a second. reduce()
+	#only averages whole blocks of pixels, so it's much cheaper than a proper resize
+	def sendpreview(self,grab):
+		
+		if self.preview == None:
+			return
+		
+		now = time.monotonic()
+		if self.previewed != None and now - self.previewed < 1.0 / self.previewrate:
+			return
+		self.previewed = now
+		
+		factor = max(1,-(-grab.width // self.preview[0]),-(-grab.height // self.preview[1]))
+		image = grab.reduce(factor) if factor > 1 else grab
+		self.progress.put(("preview",{"image":image}))
+		
+	def adapt(self,score):
+		
+		#The activity limits are for an unthinned recording
+		interval = self.adaptive.update(score,self.scheduler.interval / self.stride)
+		if interval == None:
+			return
+		interval *= self.stride
+		
+		log.info("Screen activity changed, shooting every %.2fs", interval)
+		self.scheduler.setinterval(interval)
+		
+	#Bytes the recording takes on disk
+	def diskusage(self):
+		return sum(track.diskbytes() for track in self.tracks)
+	
+	#Bytes the recording grows by per hour at the current shot rate
+	def diskrate(self):
+		
+		perframe = sum(track.diskbytes() / track.record_frame for track in self.tracks if track.record_frame > 0)
+		return perframe * 3600 / self.scheduler.interval
+	
+	#Over the disk quota: keep every other stored frame and halve the shot rate, so the
+	#frames left still cover the whole recording, evenly spaced. Repeats every time the
+	#quota fills up again, which takes twice as long each time
+	def thin(self):
+		
+		for track in self.tracks:
+			track.thin(self.stride * 2)
+			
+		self.stride *= 2
+		interval = self.scheduler.interval * 2
+		self.scheduler.setinterval(interval)
+		
+		log.warning("Disk quota reached, kept every other frame, now %.1f MB, shooting every %.1fs", self.diskusage() / 1048576, interval)
+		self.progress.put(("thinned",{"stride":self.stride,"interval":interval,"disk_bytes":self.diskusage()}))
+		
+	#Backpressure policy "slow": the writers can't keep up, so halve the shot rate
+	def slowdown(self):
+		
+		interval = self.scheduler.interval * 2
+		log.warning("Frame writers fell behind, lowering the shot interval to %.1fs", interval)
+		self.scheduler.setinterval(interval)
+		self.progress.put(("slowed",{"interval":interval}))
+		
+#Everything recorded for one region
+class Track():
+	
+	def __init__(self,worker,settings,grabbox):
+		
+		self.worker = worker
+		self.settings = settings
+		
+		#Where the region sits inside the grab, None if it is the whole grab
+		x0,y0,x1,y1 = settings.bbox()
+		gx,gy,gx1,gy1 = grabbox
+		self.box = (x0 - gx,y0 - gy,x1 - gx,y1 - gy)
+		if self.box == (0,0,gx1 - gx,gy1 - gy):
+			self.box = None
+			
+		self.record_frame = 0
+		self.stored_bytes = 0
+		self.held = 0
+		self.encoded = 0
+		self.encode_time = 0.0
+		self.encode_bytes = 0
+		self.stream = None
+		self.segments = None
+		self.detector = None
+		self.writer = None
+		self.store = None
+		self.journal = None
+		self.index = None
+		self.compactor = None
+		
+	def label(self):
+		
+		if self.settings.name == None:
+			return ""
+		return " of " + self.settings.name
+	
+	def prepare(self,resume):
+		
+		if resume:
+			session = journal.load(self.settings.folder)
+			if session != None:
+				self.record_frame = session.frames
+			log.info("Resuming%s at frame %d", self.label(), self.record_frame)
+			
+		os.makedirs(self.settings.folder,exist_ok=True)
+		self.stored_bytes = folderbytes(self.settings.folder)
+		
+		indexed = self.settings.frame_index and self.settings.mode != "stream"
+		
+		#Imported here, so numpy is only loaded when change detection is used
+		if self.settings.change_threshold > 0:
+			from lapse.change import ChangeDetector
+			self.detector = ChangeDetector(self.settings.change_threshold,mask=self.settings.change_mask)
+		elif indexed:
+			#Threshold 0 keeps every frame, and only scores how much changed for the index.
+			#The index does without scores when numpy isn't installed
+			try:
+				from lapse.change import ChangeDetector
+				self.detector = ChangeDetector(0.0,mask=self.settings.change_mask)
+			except ImportError:
+				pass
+			
+		if self.settings.mode == "stream":
+			self.stream = FFmpegStream(self.settings.video,self.settings.framesize(),self.settings.fps)
+			self.stream.open()
+		else:
+			if self.settings.storage == "container":
+				self.store = FrameStore(self.settings.folder)
+				#Frames stored after the last journal sync are lost with it
+				self.store.truncate(self.record_frame)
+				self.record_frame = min(self.record_frame,self.store.count)
+				
+			#Streams can't be continued after a crash, so only stored frames are journaled
+			self.journal = Journal(self.settings.folder,onsync=self.syncframes)
+			if resume:
+				self.journal.resume()
+			else:
+				self.journal.create(self.settings)
+				
+			if indexed:
+				self.index = FrameIndex(self.settings.folder)
+				#Rows are committed with every journal sync, a crash can only leave the index ahead
+				self.index.truncate(self.record_frame)
+				
+			if self.settings.compact:
+				self.compactor = Compactor(self.settings,self.index)
+				self.compactor.start()
+				self.stored_bytes = folderbytes(self.settings.folder) + folderbytes(self.compactor.folder)
+				
+			self.writer = WriterPool(self.settings.codec,self.settings.framepath,self.framewritten,
+				self.settings.writers,self.settings.queue_depth,self.settings.backpressure,self.worker.slowdown,self.store,self.record_frame,
+				self.index != None)
+			self.writer.warmup()
+			
+		if self.settings.mode == "segments":
+			#Segments of an interrupted recording may be half written, just encode them again
+			shutil.rmtree(os.path.join(self.settings.folder,"segments"),ignore_errors=True)
+			self.segments = SegmentEncoder(self.settings)
+			self.segments.start()
+			self.segments.frameadded(self.record_frame)
+			
+	#Keep every other stored frame, renumbered so they stay contiguous. Each frame left
+	#stands for stride shots
+	def thin(self,stride):
+		
+		#Nothing may be written while frames move around
+		self.writer.flush()
+		
+		if self.store != None:
+			count = self.store.thin()
+		else:
+			#Frame 2n becomes frame n. Going up from 0, every name moved onto is already free.
+			#A crash half way through leaves the files in a mess, unlike the store
+			count = (self.record_frame + 1) // 2
+			for i in range(1,self.record_frame):
+				if i % 2 == 1:
+					os.remove(self.settings.framepath(i))
+				else:
+					os.replace(self.settings.framepath(i),self.settings.framepath(i // 2))
+					
+		if self.index != None:
+			if self.store != None:
+				reader = FrameReader(self.settings.folder)
+				self.index.thin(lambda frame: (None,reader.entry(frame)[0]))
+				reader.close()
+			else:
+				self.index.thin(lambda frame: (self.settings.framepath(frame),None))
+				
+		self.record_frame = count
+		self.writer.written = count
+		self.journal.thinned(count,stride)
+		self.stored_bytes = folderbytes(self.settings.folder)
+		
+		log.info("Thinned%s down to %d frames", self.label(), count)
+		
+	#Bytes this region takes on disk
+	def diskbytes(self):
+		
+		if self.compactor != None:
+			return self.stored_bytes - self.compactor.saved
+		return self.stored_bytes
+		
+	def syncframes(self):
+		
+		if self.store != None:
+			self.store.sync()
+			
+		if self.index != None:
+			self.index.commit()
+			
+	def finish(self):
+		
+		if self.stream != None:
+			self.stream.close()
+			
+		if self.writer != None:
+			self.writer.close()
+			
+		#Closing the journal syncs the store, so the store goes last
+		if self.journal != None:
+			self.journal.close(self.record_frame)
+			
+		if self.store != None:
+			self.store.close()
+			
+		#Chunks being made still move frames in the index
+		if self.compactor != None:
+			self.compactor.close(self.record_frame)
+			
+		if self.index != None:
+			#Everything recorded as a concat list, with the real spacing of the shots
+			rows = self.index.select()
+			manifest.write(os.path.join(self.settings.folder,"frames.ffconcat"),self.settings.folder,rows,
+				manifest.durations([row["time"] for row in rows],None,"real"))
+			self.index.close()
+			
+		if self.segments != None:
+			self.segments.close(self.record_frame)
+			
+	#This region's frame out of a grab. Crops copy only the region's pixels, and a region
+	#covering the whole grab isn't copied at all
+	def cut(self,grab):
+		
+		frame = grab
+		if self.box != None:
+			frame = grab.crop(self.box)
+			
+		#Everything after this only ever sees output sized frames
+		if self.settings.output_size != None:
+			frame = capture.resize(frame,self.settings.output_size)
+			
+		return frame
+	
+	def saveframe(self,frame,info,thumbnail=None):
+		
+		info["region"] = self.settings.name
+		
+		#Nothing worth keeping changed, the last kept frame holds instead
+		if self.detector != None:
+			keep,info["change"] = self.detector.check(frame,thumbnail)
+			if not keep:
+				self.held += 1
+				self.worker.metrics.held += 1
+				info["held"] = self.held
+				self.worker.progress.put(("held",info))
+				return
+		
+		info["held"] = self.held
+		
+		if self.stream != None:
+			start = time.perf_counter()
+			self.stream.write(frame)
+			info["write"] = time.perf_counter() - start
+			self.framewritten(self.record_frame,info,None)
+		else:
+			self.writer.put(frame,info)
+			
+	#Called in frame order once a frame is stored. For the writer pool, this runs on
+	#its feeder thread
+	def framewritten(self,index,info,result):
+		
+		if result != None:
+			encodetime,writetime,size,offset,hashes = result
+			info["encode"] = encodetime
+			info["write"] = writetime
+			info["size"] = size
+			self.stored_bytes += size
+			self.encoded += 1
+			self.encode_time += encodetime
+			self.encode_bytes += size
+			info["encode_ms"] = self.encode_time / self.encoded * 1000
+			info["frame_bytes"] = self.encode_bytes / self.encoded
+			
+			path = None
+			if offset == None:
+				path = self.settings.framepath(index)
+			#Indexed first, so the journal sync this frame may trigger commits its row too
+			if self.index != None:
+				self.index.add(index,info["time"],hashes,info.get("change"),path,offset,size)
+				
+			self.journal.frame(index,info["time"],path,offset,size)
+			
+			#Only frames the journal has synced are compacted, and only once they have their
+			#index row, which the compactor moves to the chunk
+			if self.compactor != None and self.journal.unsynced == 0:
+				self.compactor.frameadded(index + 1)
+				
+		if self.writer != None:
+			info["dropped"] = self.writer.dropped
+			
+		info["frame"] = index
+		self.record_frame = index + 1
+		info["disk_bytes"] = self.worker.diskusage()
+		info["disk_hour"] = self.worker.diskrate()
+		self.measure(info)
+		self.worker.progress.put(("frame",info))
+		
+		if self.segments != None:
+			#The segment encoder reads the store from disk
+			if self.store != None:
+				self.store.flush()
+			self.segments.frameadded(self.record_frame)
+				
+	#Add the stage timings of a stored frame to the worker's metrics and log
+	def measure(self,info):
+		
+		metrics = self.worker.metrics
+		with metrics.lock:
+			metrics.frames += 1
+		metrics.add("convert",info["convert"])
+		if "queue_wait" in info:
+			metrics.add("queue",info["queue_wait"])
+		if "encode" in info:
+			metrics.add("encode",info["encode"],info["size"])
+		metrics.add("write",info["write"],info.get("size",0))
+		
+		info["stages"] = metrics.summary()
+		
+		if self.worker.metricslog != None:
+			ms = lambda name: round(info[name] * 1000,3) if name in info else ""
+			self.worker.metricslog.write({
+				"time":info["time"],
+				"region":self.settings.name or "",
+				"frame":info["frame"],
+				"lateness_ms":ms("lateness"),
+				"grab_ms":ms("grab"),
+				"convert_ms":ms("convert"),
+				"queue_ms":ms("queue_wait"),
+				"encode_ms":ms("encode"),
+				"write_ms":ms("write"),
+				"grab_bytes":info["grab_bytes"],
+				"frame_bytes":info.get("size",""),
+			})
+			
+#Bytes taken by the files directly in folder
+def folderbytes(folder):
+	return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
@@ -0,0 +1,223 @@
+#Parallel frame writer. Grabbed frames go into a bounded queue, and a feeder thread
+#hands them to a pool of encoder processes (png compression holds the GIL, so threads
+#wouldn't help). Frames are numbered when they leave the queue and committed strictly
+#in order, so dropping frames never leaves a gap in the numbering.
+#
+#What happens when the queue is full is up to the backpressure policy:
+#	block  wait for room, delaying the next shot
+#	drop   throw away the oldest waiting frame
+#	slow   ask the recorder to lower the shot rate, then wait for room
+
+import concurrent.futures
+import multiprocessing
+import collections
+import threading
+import queue
+import time
+
+from PIL import Image
+
+from lapse import codec
+from lapse.index import framehashes
+
+policies = ["block","drop","slow"]
+
+#Codecs parsed in each encoder process, by spec
+codecs = {}
+
+#Encode a frame and write it to path. Without a path, the encoded bytes are handed back
+#instead, for the feeder to append to a frame store. With hashes, the frame's
+#lapse.index.framehashes come back last, otherwise None
+def encodeframe(spec,mode,size,pixels,path,hashes=False):
+	
+	if spec not in codecs:
+		codecs[spec] = codec.parse(spec)
+	
+	image = Image.frombytes(mode,size,pixels)
+	
+	start = time.perf_counter()
+	data = codecs[spec].encode(image)
+	encoded = time.perf_counter()
+	
+	if hashes:
+		hashes = framehashes(image,pixels)
+	else:
+		hashes = None
+		
+	if path == None:
+		return encoded - start,data,hashes
+	
+	with open(path,"wb") as f:
+		f.write(data)
+	
+	return encoded - start,time.perf_counter() - encoded,len(data),None,hashes
+
+class WriterPool():
+	
+	#framepath(index) names the file of every frame, or with a store, frames are appended
+	#to that lapse.store.FrameStore instead. oncommit(index,info,result) is called in frame
+	#order from the feeder thread once a frame is on disk, with result being
+	#(encode seconds,write seconds,bytes,offset in the store or None,hashes or None).
+	#hashes asks for lapse.index.framehashes of every frame
+	def __init__(self,spec,framepath,oncommit,workers=2,depth=8,policy="block",onslow=None,store=None,start=0,hashes=False):
+		
+		if policy not in policies:
+			raise ValueError("Unknown backpressure policy " + policy + ", expected one of " + ", ".join(policies))
+		
+		self.spec = spec
+		self.framepath = framepath
+		self.oncommit = oncommit
+		self.workers = workers
+		self.policy = policy
+		self.onslow = onslow
+		self.store = store
+		self.hashes = hashes
+		
+		self.queue = queue.Queue(maxsize=depth)
+		#Index of the next frame, above 0 when resuming a recording
+		self.written = start
+		self.dropped = 0
+		self.slowed = False
+		self.error = None
+		
+		#spawn, so encoder processes don't inherit tk or capture handles
+		self.executor = concurrent.futures.ProcessPoolExecutor(workers,mp_context=multiprocessing.get_context("spawn"))
+		
+		self.feeder = threading.Thread(target=self.feed,daemon=True)
+		self.feeder.start()
+		
+	#Queue a frame, returns the time spent waiting for room in the queue. Until the frame
+	#is handed to an encoder, info["queued"] holds when it arrived
+	def put(self,image,info):
+		
+		if self.error != None:
+			raise self.error
+		
+		item = (image,info)
+		start = time.perf_counter()
+		info["queued"] = start
+		
+		try:
+			self.queue.put_nowait(item)
+			return 0.0
+		except queue.Full:
+			pass
+		
+		if self.policy == "drop":
+			while True:
+				try:
+					self.queue.get_nowait()
+					self.dropped += 1
+				except queue.Empty:
+					pass
+				try:
+					self.queue.put_nowait(item)
+					return 0.0
+				except queue.Full:
+					pass
+				
+		#Once per backlog, the lower rate needs a moment to drain the queue
+		if self.policy == "slow" and self.onslow != None and not self.slowed:
+			self.slowed = True
+			self.onslow()
+			
+		self.queue.put(item)
+		return time.perf_counter() - start
+	
+	#Start every encoder process now, instead of on the first frames
+	def warmup(self):
+		
+		futures = [self.executor.submit(time.sleep,0.1) for i in range(self.workers)]
+		concurrent.futures.wait(futures)
+		
+	#Wait until everything queued so far is written
+	def flush(self):
+		
+		done = threading.Event()
+		self.queue.put(done)
+		done.wait()
+		
+		if self.error != None:
+			raise self.error
+		
+	#Write everything still queued and shut the pool down
+	def close(self):
+		
+		self.queue.put(None)
+		self.feeder.join()
+		self.executor.shutdown()
+		
+		if self.error != None:
+			raise self.error
+		
+	def feed(self):
+		
+		pending = collections.deque()
+		
+		while True:
+			item = self.queue.get()
+			if item == None:
+				break
+			
+			#After a failure, keep draining the queue, so put() and close() never block on
+			#it. put() raises the error in the capture worker
+			try:
+				if self.error == None:
+					self.take(item,pending)
+			except Exception as e:
+				if self.error == None:
+					self.error = e
+			finally:
+				if isinstance(item,threading.Event):
+					item.set()
+					
+		while len(pending) > 0:
+			self.commit(*pending.popleft())
+			
+	def take(self,item,pending):
+		
+		if isinstance(item,threading.Event):
+			while len(pending) > 0:
+				self.commit(*pending.popleft())
+			return
+		
+		image,info = item
+		
+		if self.queue.qsize() == 0:
+			self.slowed = False
+			
+		path = None
+		if self.store == None:
+			path = self.framepath(self.written)
+			
+		#Seconds spent waiting in the queue, and getting the pixels out for the encoder
+		start = time.perf_counter()
+		info["queue_wait"] = start - info.pop("queued",start)
+		pixels = image.tobytes()
+		info["convert"] = info.get("convert",0.0) + time.perf_counter() - start
+		
+		future = self.executor.submit(encodeframe,self.spec,image.mode,image.size,pixels,path,self.hashes)
+		pending.append((self.written,info,future))
+		self.written += 1
+		
+		#Only as many frames in flight as there are workers, oldest first keeps order
+		while len(pending) >= self.workers:
+			self.commit(*pending.popleft())
+			
+	def commit(self,index,info,future):
+		
+		try:
+			result = future.result()
+			
+			#Appending from here keeps the store in frame order
+			if self.store != None and self.error == None:
+				encodetime,data,hashes = result
+				start = time.perf_counter()
+				stored,offset = self.store.append(data,info.get("time",0.0))
+				result = (encodetime,time.perf_counter() - start,len(data),offset,hashes)
+				
+			if self.error == None:
+				self.oncommit(index,info,result)
+		except Exception as e:
+			if self.error == None:
+				self.error = e
@@ -1,10 +1,17 @@
-import pyscreenshot as ImageGrab
 import tkinter as tk
 import fluid.fluid_light as fluid
 import fluid.fluid_progressive_light as fluid_progressive
-from PIL import ImageTk,Image  
-import os
-import shutil
+from PIL import ImageTk
+import queue
+
+from lapse.settings import Settings
+from lapse.settings import parseregions, parserenditions, parsemask
+from lapse import capture
+from lapse import writer
+from lapse.worker import CaptureWorker
+from lapse import export
+from lapse import journal
+from lapse import metrics
 
 class ScreenLapse(fluid.App):
 	
@@ -14,6 +21,17 @@ class ScreenLapse(fluid.App):
 		self.pui = fluid_progressive.Progress(self)
 		
 		self.is_recording = False
+		self.worker = None
+		self.exporter = None
+		self.preview = None
+		self.resume = None
+		self.record_settings = None
+		self.record_frame = 0
+		self.record_stats = None
+		self.record_backend = None
+		self.region_frames = {}
+		self.record_stride = 1
+		self.capture_error = None
 		
 		#Temp output
 		self.folder = "output"
@@ -35,33 +53,96 @@ class ScreenLapse(fluid.App):
 		self.i_size_x = self.pui.addinputbox("","1920")
 		self.i_size_y = self.pui.addinputbox("x","1080")
 		
+		self.pui.addlabel("Output:")
+		self.i_output_x = self.pui.addinputbox("","",width=6)
+		self.i_output_y = self.pui.addinputbox("x","",width=6)
+		
+		#Dropdowns don't show their label, it goes in front of them
+		self.pui.addlabel("Capture:")
+		self.d_backend = self.pui.adddropdown("Capture",["auto"] + capture.availablebackends())
+		
 		self.pui.stophorizontal()
 		self.pui.starthorizontal()
 		
-		self.i_spm = self.pui.addinputbox("Shots Per Minute","6")
+		#Empty records the offset and resolution above as the only region
+		self.i_regions = self.pui.addinputbox("Regions","",width=50)
 		
-		#self.b_screen = self.pui.addbutton("Screenshot")
-		#self.b_screen.setcommand(self.take_example)
+		self.pui.stophorizontal()
+		self.pui.starthorizontal()
+		
+		self.i_spm = self.pui.addinputbox("Shots Per Minute","6")
+		self.i_change = self.pui.addinputbox("Min Change %","0",width=5)
+		#x,y,WxH boxes separated by ";" that never count as a change, like a clock
+		self.i_mask = self.pui.addinputbox("Ignore","",width=20)
+		self.i_quota = self.pui.addinputbox("Quota MB","0",width=7)
 		
 		self.b_record = self.pui.addbutton("Start Recording")
 		self.b_record.setcommand(self.toggle_recording)
 		
+		self.b_discard = self.pui.addbutton("Discard")
+		self.b_discard.setcommand(self.discard_session)
+		self.b_discard.hide()
+		
+		self.pui.stophorizontal()
+		self.pui.starthorizontal()
+		
+		self.c_adaptive = self.pui.addcheckbox("Adapt to activity",0)
+		self.i_spm_min = self.pui.addinputbox("Min SPM","2",width=5)
+		self.i_spm_max = self.pui.addinputbox("Max SPM","30",width=5)
+		
 		self.pui.stophorizontal()
 		self.pui.starthorizontal()
 		
 		self.i_fps = self.pui.addinputbox("FPS","2")
 		
+		self.pui.addlabel("Mode:")
+		self.d_mode = self.pui.adddropdown("Mode",["Frames","Stream","Segments"])
+		self.d_mode.setcommand(self.change_mode)
+		#Frames per segment in Segments mode
+		self.i_segment_frames = self.pui.addinputbox("Segment Frames","300",width=6)
+		
+		self.i_codec = self.pui.addinputbox("Frame Codec","png",width=14)
+		self.pui.addlabel("Storage:")
+		self.d_storage = self.pui.adddropdown("Storage",["Files","Container"])
+		#Folds frame files into lossless video chunks while recording, Files storage only
+		self.c_compact = self.pui.addcheckbox("Compact",0)
+		
+		self.pui.stophorizontal()
+		self.pui.starthorizontal()
+		
+		self.i_writers = self.pui.addinputbox("Writers","2",width=5)
+		self.pui.addlabel("When behind:")
+		self.d_backpressure = self.pui.adddropdown("When behind",writer.policies)
+		
+		self.i_export_workers = self.pui.addinputbox("Export Workers","1",width=5)
+		#Even shows every frame equally long, Real keeps the spacing they were captured with
+		self.pui.addlabel("Timing:")
+		self.d_timing = self.pui.adddropdown("Timing",["Even","Real"])
+		#Exporting again at another FPS is then only a quick copy
+		self.c_cache = self.pui.addcheckbox("Cache",0)
 		self.b_export = self.pui.addbutton("Export")
 		self.b_export.setcommand(command=self.autosave_video)
 		
+		self.b_cancel = self.pui.addbutton("Cancel")
+		self.b_cancel.setcommand(command=self.cancel_export)
+		self.b_cancel.hide()
+		
+		self.pui.stophorizontal()
+		self.pui.starthorizontal()
+		
+		#file:WxH[,codec][,bitrate][,Nfps][,Ns] separated by ";", all exported in one pass instead of the video
+		self.i_renditions = self.pui.addinputbox("Renditions","",width=50)
+		
 		self.pui.stophorizontal()
 		self.pui.starthorizontal()
 		
 		self.l_exportinfo = self.pui.addlabel("")
 		
-		#self.pui.stophorizontal()
-		#self.pui.starthorizontal()
-		#self.example_canvas = self.pui.addcustom(tk.Canvas,width = 400, height = 200)  
+		self.pui.stophorizontal()
+		self.pui.starthorizontal()
+		
+		#Live view of what is being grabbed, thumbnails come from the capture worker
+		self.c_preview = self.pui.addcustom(tk.Canvas,width = 400, height = 200)
 		
 		self.pui.stophorizontal()
 		self.pui.stopvertical()
@@ -70,28 +151,57 @@ class ScreenLapse(fluid.App):
 		self.i_fps.disable()
 		self.b_export.disable()
 		
-	def take_example(self):
+		self.checkjournal()
 		
-		sx = float(self.i_size_x.getvalue())
-		sy = float(self.i_size_y.getvalue())
+	#Offer to resume or export a recording that was cut short by a crash
+	def checkjournal(self):
 		
-		img = self.screenshot()
-		img = img.resize((400,200),Image.ANTIALIAS)
+		session = journal.interrupted(self.folder)
+		if session == None:
+			return
 		
-		self.example = ImageTk.PhotoImage(img)  
+		self.resume = session
+		self.record_settings = session.settings
+		self.record_frame = session.frames
 		
-		#self.example_canvas.config(width = sx,height = sy)
-		self.example_canvas.create_image(0, 0, anchor="nw", image=self.example )  
+		#A disabled entry ignores setvalue, so the journaled FPS wouldn't show otherwise
+		self.i_fps.enable()
+		self.writesettings(session.settings)
 		
-	def screenshot(self):
-		ox = int(self.i_offset_x.getvalue())
-		oy = int(self.i_offset_y.getvalue())
-		sx = ox + int(self.i_size_x.getvalue())
-		sy = oy + int(self.i_size_y.getvalue())
+		self.b_record.button.config(text='Resume Recording')
+		self.b_discard.show()
+		
+		if session.frames > 0:
+			self.b_export.enable()
+			
+		self.l_exportinfo.setText("Found an interrupted recording with " + str(session.frames) + " frames.\nResume it, export it, or discard it.")
+		
+	def discard_session(self):
+		
+		self.resume = None
+		self.b_discard.hide()
+		self.b_record.button.config(text='Start Recording')
+		self.b_export.disable()
+		self.change_mode()
+		self.l_exportinfo.setText("")
+		
+	#Streaming and segments encode while recording, so the FPS has to be chosen up front
+	def change_mode(self,*args):
+		
+		if self.d_mode.getvalue() != "Frames":
+			self.i_fps.enable()
+		elif self.b_export.button["state"] == "disabled":
+			self.i_fps.disable()
+			
+	#Show a thumbnail the capture worker sent, centered in the preview canvas
+	def show_preview(self,image):
+		
+		#Tk only draws the PhotoImage while something holds on to it
+		self.preview = ImageTk.PhotoImage(image)
+		
+		self.c_preview.delete("all")
+		self.c_preview.create_image(200, 100, anchor="center", image=self.preview)
 		
-		im = ImageGrab.grab(bbox=(ox, oy, sx, sy))
-		return im
-	
 	def toggle_recording(self):
 		
 		if self.is_recording:
@@ -101,81 +211,361 @@ class ScreenLapse(fluid.App):
 			
 	def start_recording(self):
 		
+		#Catch bad input before anything changes
+		try:
+			settings = self.readsettings()
+			settings.framecodec()
+		except (ValueError,RuntimeError) as e:
+			self.l_exportinfo.setText(str(e))
+			return
+		
+		#A resumed recording has to carry on exactly as it was recorded
+		resume = self.resume
+		if resume != None:
+			settings = resume.settings
+			self.resume = None
+			self.b_discard.hide()
+		
 		self.i_offset_x.disable()
 		self.i_offset_y.disable()
 		self.i_size_x.disable()
 		self.i_size_y.disable()
+		self.i_output_x.disable()
+		self.i_output_y.disable()
+		self.i_regions.disable()
+		self.d_backend.menu.config(state="disabled")
 		self.i_spm.disable()
+		self.i_change.disable()
+		self.i_mask.disable()
+		self.i_quota.disable()
+		self.c_adaptive.check.config(state="disabled")
+		self.i_spm_min.disable()
+		self.i_spm_max.disable()
 		self.i_fps.disable()
+		self.i_codec.disable()
+		self.i_segment_frames.disable()
+		self.d_storage.menu.config(state="disabled")
+		self.c_compact.check.config(state="disabled")
+		self.i_writers.disable()
+		self.d_backpressure.menu.config(state="disabled")
+		self.d_mode.menu.config(state="disabled")
 		self.b_export.disable()
 		
 		self.b_record.button.config(text='Stop Recording')
 		self.l_exportinfo.setText("Recording...")
 		
 		self.is_recording = True
-		self.record_frame = 0
+		self.record_frame = 0 if resume == None else resume.frames
+		self.record_stats = None
+		self.record_backend = None
+		self.region_frames = {}
+		self.record_stride = 1 if resume == None else resume.stride
+		self.capture_error = None
 		
-		#Clear existing folder
-		try:
-			shutil.rmtree(self.folder)
-		except:
-			pass
-			
-		self.saveframe()
+		self.record_settings = settings
+		self.worker = CaptureWorker(self.record_settings,resume,(400,200))
+		self.worker.start()
+		
+		self.pollworker()
 		
 	def stop_recording(self):
 		
+		#Wait for the worker to finish its last frame before allowing exporting
+		self.b_record.disable()
+		self.l_exportinfo.setText("Stopping...")
+		
+		self.is_recording = False
+		self.worker.stop()
+		
+	def worker_stopped(self):
+		
 		self.i_offset_x.enable()
 		self.i_offset_y.enable()
 		self.i_size_x.enable()
 		self.i_size_y.enable()
+		self.i_output_x.enable()
+		self.i_output_y.enable()
+		self.i_regions.enable()
+		self.d_backend.menu.config(state="normal")
 		self.i_spm.enable()
+		self.i_change.enable()
+		self.i_mask.enable()
+		self.i_quota.enable()
+		self.c_adaptive.check.config(state="normal")
+		self.i_spm_min.enable()
+		self.i_spm_max.enable()
+		self.i_codec.enable()
+		self.i_segment_frames.enable()
+		self.d_storage.menu.config(state="normal")
+		self.c_compact.check.config(state="normal")
+		self.i_writers.enable()
+		self.d_backpressure.menu.config(state="normal")
+		self.d_mode.menu.config(state="normal")
 		
 		self.b_record.button.config(text='Start Recording')
+		self.b_record.enable()
 		self.is_recording = False
 		
 		#Allow exporting now
 		self.i_fps.enable()
+		
+		if self.record_settings.mode == "stream":
+			self.update_frame_ui()
+			if self.capture_error == None:
+				self.l_exportinfo.setText(self.l_exportinfo.label["text"] + "\nSaved video")
+			return
+		
 		self.b_export.enable()
 		
 		self.update_frame_ui()
 		
+	def readsettings(self):
+		
+		settings = Settings()
+		settings.offset = (int(self.i_offset_x.getvalue()),int(self.i_offset_y.getvalue()))
+		settings.size = (int(self.i_size_x.getvalue()),int(self.i_size_y.getvalue()))
+		
+		#Left empty, frames keep the recorded size
+		if self.i_output_x.getvalue().strip() != "" or self.i_output_y.getvalue().strip() != "":
+			settings.output_size = (int(self.i_output_x.getvalue()),int(self.i_output_y.getvalue()))
+			
+		settings.regions = parseregions(self.i_regions.getvalue())
+		settings.spm = float(self.i_spm.getvalue())
+		settings.fps = float(self.i_fps.getvalue())
+		settings.change_threshold = float(self.i_change.getvalue()) / 100
+		settings.change_mask = parsemask(self.i_mask.getvalue())
+		settings.quota_mb = max(0,int(self.i_quota.getvalue()))
+		settings.adaptive = self.c_adaptive.getvalue() == 1
+		settings.spm_min = float(self.i_spm_min.getvalue())
+		settings.spm_max = float(self.i_spm_max.getvalue())
+		settings.folder = self.folder
+		settings.mode = self.d_mode.getvalue().lower()
+		settings.segment_frames = max(1,int(self.i_segment_frames.getvalue()))
+		settings.backend = self.d_backend.getvalue()
+		settings.codec = self.i_codec.getvalue().strip()
+		settings.storage = self.d_storage.getvalue().lower()
+		settings.compact = self.c_compact.getvalue() == 1
+		settings.writers = max(1,int(self.i_writers.getvalue()))
+		settings.backpressure = self.d_backpressure.getvalue()
+		return settings
+	
+	#Show settings in the ui, for a recording picked up from its journal
+	def writesettings(self,settings):
+		
+		self.i_offset_x.setvalue(str(settings.offset[0]))
+		self.i_offset_y.setvalue(str(settings.offset[1]))
+		self.i_size_x.setvalue(str(settings.size[0]))
+		self.i_size_y.setvalue(str(settings.size[1]))
+		
+		if settings.output_size != None:
+			self.i_output_x.setvalue(str(settings.output_size[0]))
+			self.i_output_y.setvalue(str(settings.output_size[1]))
+			
+		self.i_regions.setvalue(";".join(formatregion(region) for region in settings.regions))
+		
+		self.i_spm.setvalue(str(settings.spm))
+		self.i_change.setvalue(str(settings.change_threshold * 100))
+		self.i_mask.setvalue(";".join(formatbox(box) for box in settings.change_mask))
+		self.i_quota.setvalue(str(settings.quota_mb))
+		self.c_adaptive.setvalue(1 if settings.adaptive else 0)
+		self.i_spm_min.setvalue(str(settings.spm_min))
+		self.i_spm_max.setvalue(str(settings.spm_max))
+		self.i_fps.setvalue(str(settings.fps))
+		self.d_mode.setvalue(settings.mode.capitalize())
+		self.i_segment_frames.setvalue(str(settings.segment_frames))
+		self.i_codec.setvalue(settings.codec)
+		self.d_storage.setvalue(settings.storage.capitalize())
+		self.c_compact.setvalue(1 if settings.compact else 0)
+		self.i_writers.setvalue(str(settings.writers))
+		self.d_backpressure.setvalue(settings.backpressure)
+		
+		if settings.backend in capture.availablebackends():
+			self.d_backend.setvalue(settings.backend)
+			
+	#Drain progress from the capture worker, without ever blocking the mainloop
+	def pollworker(self):
+		
+		#Only the newest preview that arrived since the last poll is worth drawing
+		preview = None
+		
+		while True:
+			try:
+				kind,info = self.worker.progress.get_nowait()
+			except queue.Empty:
+				break
+			
+			if kind == "frame":
+				self.region_frames[info["region"]] = info["frame"] + 1
+				#The first region stands in for the whole recording
+				if info["region"] == self.record_settings.regionsettings()[0].name:
+					self.record_frame = info["frame"] + 1
+					self.record_stats = info
+				self.update_frame_ui()
+			elif kind == "held":
+				self.record_stats = info
+				self.update_frame_ui()
+			elif kind == "preview":
+				preview = info["image"]
+			elif kind == "thinned":
+				self.record_stride = info["stride"]
+			elif kind == "backend":
+				self.record_backend = info["name"]
+			elif kind == "error":
+				self.capture_error = info["message"]
+			elif kind == "stopped":
+				self.worker_stopped()
+				return
+			
+		if preview != None:
+			self.show_preview(preview)
+			
+		self.frame.after(100, self.pollworker)
+		
 	def update_frame_ui(self):
 		
-		rtime = int(self.record_frame / (float(self.i_spm.getvalue()) / 60))
-		self.l_exportinfo.setText("Total Frames: " + str(self.record_frame) + "\nTotal Recording Time: " + str(rtime) + " seconds")
+		#Real time from the first to the last shot, not frames * interval
+		rtime = 0
+		if self.record_stats != None:
+			rtime = int(self.record_stats["elapsed"])
+			
+		text = "Total Frames: " + str(self.record_frame) + "\nTotal Recording Time: " + str(rtime) + " seconds"
+		
+		if len(self.region_frames) > 1:
+			text += "\nRegions: " + ", ".join(str(name) + " " + str(frames) for name,frames in self.region_frames.items())
+			
+		if self.record_backend != None:
+			text += "\nCapture Backend: " + self.record_backend
+			
+		if self.record_stats != None:
+			text += "\nMissed Shots: " + str(self.record_stats["missed"])
+			text += "\nShot Lateness: " + "{:.0f}".format(self.record_stats["lateness_mean"] * 1000) + "ms avg, "
+			text += "{:.0f}".format(self.record_stats["lateness_max"] * 1000) + "ms max"
+			text += "\nHeld Shots: " + str(self.record_stats["held"])
+			
+			if self.record_settings.adaptive:
+				text += "\nShots Per Minute: " + "{:.1f}".format(self.record_stats["spm"])
+			
+		if self.record_stats != None and self.record_stats.get("dropped",0) > 0:
+			text += "\nDropped Frames: " + str(self.record_stats["dropped"])
+			
+		if self.record_stats != None and "encode_ms" in self.record_stats:
+			text += "\nFrame Encode: " + "{:.0f}".format(self.record_stats["encode_ms"]) + "ms, "
+			text += "{:.0f}".format(self.record_stats["frame_bytes"] / 1024) + "KB per frame (" + self.record_settings.codec + ")"
+		
+		if self.record_stats != None and "disk_bytes" in self.record_stats:
+			text += "\nDisk: " + "{:.1f}".format(self.record_stats["disk_bytes"] / 1048576) + " MB"
+			if self.record_settings.quota_mb > 0:
+				text += " of " + str(self.record_settings.quota_mb) + " MB"
+			text += ", " + "{:.1f}".format(self.record_stats["disk_hour"] / 1048576) + " MB more per hour"
+			
+		if self.record_stride > 1:
+			text += "\nThinned to every " + str(self.record_stride) + "th shot to fit the quota"
+			
+		#Where the time of a frame goes, to tell a slow capture, codec or disk apart
+		if self.record_stats != None and "stages" in self.record_stats:
+			stages = self.record_stats["stages"]
+			text += "\nStages (p50/p99 ms): " + ", ".join(stage + " " + "{:.0f}/{:.0f}".format(stages[stage]["p50"],stages[stage]["p99"]) for stage in metrics.stages if stage in stages)
+			
+		if self.capture_error != None:
+			text += "\nCapture failed: " + self.capture_error
+			
+		self.l_exportinfo.setText(text)
 	
 	
-	def saveframe(self):
+	#Exports run on their own thread, pollexport shows how far they got
+	def autosave_video(self):
 		
-		#Detect completion of recording
-		if self.is_recording == False:
+		try:
+			self.record_settings.export_workers = max(1,int(self.i_export_workers.getvalue()))
+			self.record_settings.export_timing = self.d_timing.getvalue().lower()
+			self.record_settings.export_cache = self.c_cache.getvalue() == 1
+			self.record_settings.renditions = parserenditions(self.i_renditions.getvalue())
+			fps = float(self.i_fps.getvalue())
+		except ValueError as e:
+			self.l_exportinfo.setText(str(e))
 			return
 		
-		try:
-			os.mkdir(self.folder)
-		except:
-			pass
+		self.b_export.disable()
+		self.b_record.disable()
+		self.b_discard.disable()
+		self.i_fps.disable()
+		self.i_export_workers.disable()
+		self.d_timing.menu.config(state="disabled")
+		self.c_cache.check.config(state="disabled")
+		self.i_renditions.disable()
+		self.b_cancel.show()
+		self.l_exportinfo.setText("Exporting...")
+		
+		self.exporter = export.ExportJob(self.record_settings,fps)
+		self.exporter.start()
+		
+		self.pollexport()
+		
+	def cancel_export(self):
+		
+		self.b_cancel.disable()
+		self.l_exportinfo.setText("Cancelling...")
+		self.exporter.cancel()
+		
+	def pollexport(self):
+		
+		while True:
+			try:
+				kind,info = self.exporter.progress.get_nowait()
+			except queue.Empty:
+				break
+			
+			if kind == "progress":
+				if not self.exporter.cancelled:
+					self.update_export_ui(info)
+			elif kind == "done":
+				self.l_exportinfo.setText(export.describe(info["results"]))
+			elif kind == "error":
+				self.l_exportinfo.setText("Export failed: " + info["message"])
+			elif kind == "cancelled":
+				self.l_exportinfo.setText("Export cancelled")
+				
+			if kind != "progress":
+				self.export_stopped()
+				return
 			
-		screenshot = self.screenshot()
-		screenshot.save(self.folder + "/img_" + "{:02d}".format(self.record_frame) + ".png")
+		self.frame.after(100, self.pollexport)
 		
-		self.record_frame += 1
+	def update_export_ui(self,info):
 		
-		self.update_frame_ui()
+		text = "Exporting " + str(info["video"]) + ": " + str(info["frames"]) + " / " + str(info["total"]) + " frames"
+		text += ", " + "{:.1f}".format(info["fps"]) + " fps"
+		if info["eta"] != None:
+			text += ", " + str(int(info["eta"])) + " seconds left"
+			
+		self.l_exportinfo.setText(text)
 		
-		delay = int(60000 / float(self.i_spm.getvalue()))
-		self.frame.after(delay, self.saveframe)
-	
-	def autosave_video(self):
+	def export_stopped(self):
 		
-		self.save_video("video.mp4")
+		self.exporter = None
+		self.b_cancel.hide()
+		self.b_cancel.enable()
+		self.b_export.enable()
+		self.b_record.enable()
+		self.b_discard.enable()
+		self.i_fps.enable()
+		self.i_export_workers.enable()
+		self.d_timing.menu.config(state="normal")
+		self.c_cache.check.config(state="normal")
+		self.i_renditions.enable()
 		
-		self.l_exportinfo.setText("Saved video")
+def formatregion(region):
 	
-	def save_video(self,output):
-		
-		fps = str(float(self.i_fps.getvalue()))
-		os.system("ffmpeg -y -framerate " + fps + " -i " + self.folder + "/img_%02d.png " + output)
+	text = region["name"] + ":" + str(region["offset"][0]) + "," + str(region["offset"][1]) + "," + str(region["size"][0]) + "x" + str(region["size"][1])
+	if region.get("output_size") != None:
+		text += ">" + str(region["output_size"][0]) + "x" + str(region["output_size"][1])
+	return text
+
+def formatbox(box):
+	
+	x0,y0,x1,y1 = box
+	return str(x0) + "," + str(y0) + "," + str(x1 - x0) + "x" + str(y1 - y0)
 
-fluid.quicksetupapp(ScreenLapse,"ScreenLapse")
+#Encoder processes import this module, they mustn't open a window
+if __name__ == "__main__":
+	fluid.quicksetupapp(ScreenLapse,"ScreenLapse")